@@ -0,0 +1,73 @@
+"""Compare the per-request and write-behind paths of /api/submit_copied_text.
+
+Runs the app in-process against a scratch SQLite database (or DATABASE_URL if set) and reports
+throughput, database commits per second and request latency percentiles for each mode:
+
+    python bench_submit.py [requests] [concurrency] [users]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+async def run_mode(total_requests, concurrency, user_count):
+    import httpx
+    from sqlalchemy import event
+    import server
+
+    commits = 0
+
+    def count_commit(connection):
+        nonlocal commits
+        commits += 1
+
+    for engine in server.shard_router.engines:
+        event.listen(engine, "commit", count_commit)
+    await server.app.router.startup()
+    latencies = []
+    pending = iter(range(total_requests))
+
+    async def worker(client):
+        for index in pending:
+            started = time.perf_counter()
+            response = await client.post(f"/api/submit_copied_text/bench{index % user_count}",
+                                         json={"text": f"text {index}"})
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        commits = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        acknowledged = time.perf_counter() - started
+        await server.app.router.shutdown()  # Waits for the write-behind buffer to drain
+        durable = time.perf_counter() - started
+
+    mode = "write-behind" if server.WRITE_BEHIND else "per-request"
+    summary = server.latency_percentiles(latencies)  # Nearest rank, as the server's latency report
+    print(f"{mode:>12}: {total_requests} requests, {total_requests / acknowledged:8.0f} req/s acknowledged, "
+          f"{total_requests / durable:8.0f} req/s durable, {commits} commits ({commits / durable:7.0f}/s), "
+          f"p50 {summary['p50']:6.1f} ms, p99 {summary['p99']:6.1f} ms")
+
+def main():
+    args = sys.argv[1:4]
+    if os.getenv("BENCH_CHILD"):
+        total_requests, concurrency, user_count = (int(arg) for arg in args)
+        asyncio.run(run_mode(total_requests, concurrency, user_count))
+        return
+
+    args = args + ["2000", "50", "20"][len(args):]
+    for write_behind in ("0", "1"):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, BENCH_CHILD="1", WRITE_BEHIND=write_behind)
+            env.setdefault("DATABASE_URL", f"sqlite:///{directory}/bench.db")
+            output = subprocess.run([sys.executable, __file__, *args], env=env, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            lines = [line for line in output.stdout.splitlines() if "req/s" in line]
+            print("\n".join(lines) or output.stdout + output.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+import httpx
+from clipboard_sync import ClipboardSync
+
+# Configuration
+API_BASE_URL = "https://clipboard-app-seven.vercel.app"  # Your Vercel URL
+
+# Asyncio client core for relay and kiosk deployments: one process, one event loop and one HTTP
+# connection pool sync the clipboards of many accounts. Each account gets its own clipboard source,
+# either the desktop clipboard or a headless in-memory one.
+
+class MemoryClipboard:
+    """Headless clipboard held in memory, for processes without a desktop session."""
+
+    def __init__(self, text=""):
+        self.text = text
+
+    async def paste(self):
+        return self.text
+
+    async def copy(self, text):
+        self.text = text
+
+class SystemClipboard:
+    """The desktop clipboard through pyperclip, called off the event loop since pyperclip blocks."""
+
+    def __init__(self):
+        import pyperclip
+        self.pyperclip = pyperclip
+
+    async def paste(self):
+        return await asyncio.to_thread(self.pyperclip.paste)
+
+    async def copy(self, text):
+        await asyncio.to_thread(self.pyperclip.copy, text)
+
+class AccountSync:
+    """Clipboard sync for one account: uploads local changes and applies updates from the server."""
+
+    def __init__(self, http, username, clipboard, device_id=None, poll_interval=2.0, monitor_interval=1.0):
+        self.http = http
+        self.username = username
+        self.clipboard = clipboard
+        self.poll_interval = poll_interval
+        self.monitor_interval = monitor_interval
+        # Pass a saved device id so restarts don't refetch updates; see clipboard_sync for the shared state
+        self.sync = ClipboardSync(device_id or uuid.uuid4().hex)
+        self.clipboard_lock = asyncio.Lock()  # Keeps remote updates and local change detection in step
+
+    async def run(self):
+        # Spread accounts over the poll interval so hundreds of them don't poll in lockstep
+        await asyncio.sleep(random.uniform(0, self.poll_interval))
+        self.sync.mark_seen(await self.clipboard.paste())
+        await asyncio.gather(self.monitor_clipboard(), self.poll_for_clipboard_updates())
+
+    async def monitor_clipboard(self):
+        """Watch the clipboard for changes and send them to the server."""
+        while True:
+            await self.check_clipboard()
+            await asyncio.sleep(self.monitor_interval)
+
+    async def check_clipboard(self):
+        try:
+            async with self.clipboard_lock:
+                current_content = await self.clipboard.paste()
+                is_new_content = self.sync.local_change(current_content)
+            if is_new_content:
+                await self.submit_text_to_server(current_content)
+        except Exception as e:
+            print(f"[{self.username}] Error monitoring clipboard: {e}")
+
+    async def poll_for_clipboard_updates(self):
+        """Poll the server for new clipboard updates."""
+        while True:
+            await self.poll_once()
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll_once(self):
+        try:
+            response = await self.http.get(f"/api/get_latest_clipboard/{self.username}",
+                                           params=self.sync.poll_params(), headers=self.sync.poll_headers())
+            if response.status_code != 304:
+                response.raise_for_status()
+                await self.apply_clipboard_update(response.headers.get("ETag"), response.json(),
+                                                  received_ts=time.time())
+        except Exception as e:
+            # Also covers bad response bodies, which would otherwise end this account's polling silently
+            print(f"[{self.username}] Error polling for clipboard updates: {e}")
+
+    async def apply_clipboard_update(self, etag, data, received_ts):
+        update = self.sync.polled(etag, data, received_ts)
+        if update is None:
+            return
+        version, text = update
+        async with self.clipboard_lock:
+            self.sync.mark_seen(text)
+            await self.clipboard.copy(text)
+        ack = self.sync.applied(version, received_ts, time.time())
+        print(f"[{self.username}] Applied clipboard version {version}")
+        try:
+            response = await self.http.post(f"/api/ack_clipboard/{self.username}", json=ack)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"[{self.username}] Error acknowledging clipboard update: {e}")
+
+    async def submit_text_to_server(self, text):
+        submission = self.sync.submission(text)
+        try:
+            response = await self.http.post(f"/api/submit_copied_text/{self.username}", json=submission)
+            response.raise_for_status()
+            data = response.json()
+            self.sync.submitted(submission, data, time.time())
+            if data["status"] != "success":
+                print(f"[{self.username}] Error: {data['message']}")
+        except httpx.HTTPError as e:
+            print(f"[{self.username}] Error: Failed to submit copied text: {e}")
+
+class ClipboardClient:
+    """Runs clipboard sync for many accounts on one event loop and one HTTP connection pool."""
+
+    def __init__(self, base_url=API_BASE_URL, max_connections=50, timeout=10.0):
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+        )
+        self.accounts = {}
+        self.tasks = {}
+
+    async def authenticate(self, username, password):
+        """Check credentials with the server, returning the canonical username or None."""
+        try:
+            response = await self.http.post("/api/authenticate", data={"username": username, "password": password})
+            data = response.json()
+            if data["status"] == "success":
+                return data["username"]
+            print(f"[{username}] Login failed: {data['message']}")
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"[{username}] Error: Failed to connect to server: {e}")
+        return None
+
+    async def add_account(self, username, password, clipboard=None, **options):
+        """Log an account in and start syncing it; clipboard defaults to a headless MemoryClipboard."""
+        username = await self.authenticate(username, password)
+        if not username:
+            return None
+        await self.remove_account(username)
+        account = AccountSync(self.http, username, clipboard or MemoryClipboard(), **options)
+        self.accounts[username] = account
+        self.tasks[username] = asyncio.create_task(account.run())
+        return account
+
+    async def remove_account(self, username):
+        task = self.tasks.pop(username, None)
+        account = self.accounts.pop(username, None)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if account:
+            print(f"[{username}] Sync latency: " + "; ".join(account.sync.latency_summary()))
+
+    async def close(self):
+        for username in list(self.tasks):
+            await self.remove_account(username)
+        await self.http.aclose()
+
+async def run_relay(accounts_file):
+    """Sync every account listed in a JSON file ([{"username": ..., "password": ...}]) with headless clipboards.
+
+    Each account's device id is saved back to the file on first run, so restarts keep it.
+    """
+    with open(accounts_file) as f:
+        credentials = json.load(f)
+    if not all(item.get("device_id") for item in credentials):
+        for item in credentials:
+            item["device_id"] = item.get("device_id") or uuid.uuid4().hex
+        with open(accounts_file, "w") as f:
+            json.dump(credentials, f, indent=2)
+    client = ClipboardClient()
+    try:
+        results = await asyncio.gather(*(client.add_account(item["username"], item["password"],
+                                                            device_id=item["device_id"])
+                                         for item in credentials))
+        print(f"Relay running for {sum(1 for account in results if account)} of {len(credentials)} accounts")
+        await asyncio.Event().wait()
+    finally:
+        await client.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python clipboard_client.py <accounts.json>")
+        sys.exit(1)
+    try:
+        asyncio.run(run_relay(sys.argv[1]))
+    except KeyboardInterrupt:
+        print("\nRelay stopped.")
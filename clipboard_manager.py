@@ -1,33 +1,118 @@
 import requests
 import pyperclip
 import json
+import os
+import sqlite3
 import threading
 import time
+import uuid
+from clipboard_sync import ClipboardSync
 
 # Configuration
 API_BASE_URL = "https://clipboard-app-seven.vercel.app"  # Your Vercel URL
+LOCAL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".clipboard_manager")  # Local history cache location
+HISTORY_SYNC_INTERVAL = 30  # Seconds between background history reconciliations
+
+def load_device_id():
+    """Return this machine's device id, created on first run and kept in LOCAL_CACHE_DIR after that."""
+    path = os.path.join(LOCAL_CACHE_DIR, "device_id")
+    try:
+        with open(path) as f:
+            device_id = f.read().strip()
+        if device_id:
+            return device_id
+    except OSError:
+        pass
+    device_id = uuid.uuid4().hex
+    try:
+        os.makedirs(LOCAL_CACHE_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(device_id)
+    except OSError as e:
+        print(f"Error saving device id: {e}")
+    return device_id
+
+class LocalHistoryStore:
+    """On-disk copy of a user's copied text history, with its newest item kept in memory.
+
+    Items are keyed by their server id; the cursor is the newest server id seen, so reconciling only
+    fetches items added since the last sync. The epoch is the server's numbering of those ids, which
+    changes when the user's data moves to another database shard.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, text TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.newest_text = self.load_newest_text()
+
+    def load_newest_text(self):
+        row = self.db.execute("SELECT text FROM items ORDER BY id DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def meta_value(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else None
+
+    def cursor(self):
+        return self.meta_value("cursor")
+
+    def epoch(self):
+        return self.meta_value("epoch")
+
+    def most_recent(self):
+        return self.newest_text
+
+    def missing_ids(self, ids):
+        """Return which of the given server ids aren't stored locally."""
+        with self.lock:
+            stored = {row[0] for row in self.db.execute("SELECT id FROM items")}
+        return set(ids) - stored
+
+    def apply_changes(self, items, current_ids, cursor, epoch=None):
+        """Add new server items, drop items no longer on the server and move the cursor."""
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO items (id, text) VALUES (?, ?)",
+                                [(item["id"], item["text"]) for item in items])
+            placeholders = ",".join("?" * len(current_ids))
+            self.db.execute(f"DELETE FROM items WHERE id NOT IN ({placeholders})", list(current_ids))
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('cursor', ?)", (str(cursor),))
+            if epoch is not None:
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('epoch', ?)", (str(epoch),))
+            self.db.commit()
+            self.newest_text = self.load_newest_text()
+
+    def close(self):
+        self.db.close()
 
 class ClipboardManager:
     def __init__(self):
         self.username = None
         self.role = None
-        self.copied_text_history = []
+        self.history_store = None  # Local copy of copied_text_history, see LocalHistoryStore
+        self.history_sync_thread = None
+        self.history_etag = None
         self.clipboard_monitor_thread = None
         self.polling_thread = None
         self.running = False
-        self.last_clipboard_content = None
-        self.last_submitted_text = None
+        self.sync = ClipboardSync(load_device_id())  # Echo suppression, versions and latency, see clipboard_sync
+        self.clipboard_lock = threading.Lock()  # Keeps remote updates and local change detection in step
 
     def monitor_clipboard(self):
         """Monitor the system clipboard for changes and send updates to the server."""
         print("Starting clipboard monitoring...")
-        self.last_clipboard_content = pyperclip.paste()
+        self.sync.mark_seen(pyperclip.paste())
         while self.running:
             try:
-                current_content = pyperclip.paste()
-                if current_content != self.last_clipboard_content and current_content.strip():
+                with self.clipboard_lock:
+                    current_content = pyperclip.paste()
+                    is_new_content = self.sync.local_change(current_content)
+                if is_new_content:
                     print(f"New clipboard content detected: {current_content}")
-                    self.last_clipboard_content = current_content
                     self.submit_text_to_server(current_content)
             except Exception as e:
                 print(f"Error monitoring clipboard: {e}")
@@ -38,19 +123,36 @@ class ClipboardManager:
         print("Starting polling for clipboard updates...")
         while self.running:
             try:
-                response = requests.get(f"{API_BASE_URL}/api/get_latest_clipboard/{self.username}")
+                response = requests.get(
+                    f"{API_BASE_URL}/api/get_latest_clipboard/{self.username}",
+                    params=self.sync.poll_params(),
+                    headers=self.sync.poll_headers()
+                )
                 response.raise_for_status()
-                data = response.json()
-                if data["status"] == "success" and data["text"]:
-                    new_text = data["text"]
-                    if new_text != self.last_submitted_text:
-                        pyperclip.copy(new_text)
-                        self.last_submitted_text = new_text
-                        print(f"Copied to system clipboard: {new_text}")
-            except requests.RequestException as e:
+                if response.status_code != 304:
+                    self.apply_clipboard_update(response.headers.get("ETag"), response.json(), received_ts=time.time())
+            except Exception as e:
+                # Also covers bad response bodies, which would otherwise end polling silently
                 print(f"Error polling for clipboard updates: {e}")
             time.sleep(2)  # Poll every 2 seconds
 
+    def apply_clipboard_update(self, etag, data, received_ts):
+        """Copy a new server clipboard update into the system clipboard and acknowledge it."""
+        update = self.sync.polled(etag, data, received_ts)
+        if update is None:
+            return
+        version, new_text = update
+        with self.clipboard_lock:
+            self.sync.mark_seen(new_text)
+            pyperclip.copy(new_text)
+        ack = self.sync.applied(version, received_ts, time.time())
+        print(f"Copied to system clipboard: {new_text}")
+        try:
+            response = requests.post(f"{API_BASE_URL}/api/ack_clipboard/{self.username}", json=ack)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Error acknowledging clipboard update: {e}")
+
     def start_clipboard_monitoring(self):
         """Start the clipboard monitoring thread."""
         self.running = True
@@ -64,6 +166,12 @@ class ClipboardManager:
         self.polling_thread.daemon = True
         self.polling_thread.start()
 
+    def start_history_sync(self):
+        """Start the thread keeping the local history cache in step with the server."""
+        self.history_sync_thread = threading.Thread(target=self.sync_history_loop)
+        self.history_sync_thread.daemon = True
+        self.history_sync_thread.start()
+
     def stop_clipboard_monitoring(self):
         """Stop the clipboard monitoring and polling threads."""
         self.running = False
@@ -71,6 +179,16 @@ class ClipboardManager:
             self.clipboard_monitor_thread.join()
         if self.polling_thread:
             self.polling_thread.join()
+        if self.history_sync_thread:
+            self.history_sync_thread.join()
+        if self.history_store:
+            self.history_store.close()
+        self.print_latency_summary()
+
+    def print_latency_summary(self):
+        print("Sync latency on this device:")
+        for line in self.sync.latency_summary():
+            print(f"  {line}")
 
     def authenticate(self):
         print("\n=== Login ===")
@@ -106,30 +224,75 @@ class ClipboardManager:
             return False
 
     def load_clipboard_data(self):
+        """Start from the locally cached history, then reconcile with the server in the background."""
         if not self.username:
             print("Error: Not logged in.")
             return False
 
         try:
-            response = requests.get(f"{API_BASE_URL}/api/copied_text_history/{self.username}")
+            os.makedirs(LOCAL_CACHE_DIR, exist_ok=True)
+            self.history_store = LocalHistoryStore(os.path.join(LOCAL_CACHE_DIR, f"{self.username}.db"))
+        except (OSError, sqlite3.Error) as e:
+            # Keep the history in memory for this session; it's fetched from the server again next time
+            print(f"Error: Failed to open local history cache, running without it: {e}")
+            self.history_store = LocalHistoryStore(":memory:")
+
+        most_recent_item = self.history_store.most_recent()
+        if most_recent_item is not None:
+            self.copy_history_item(most_recent_item)
+        else:
+            print("No cached history yet; loading it from the server in the background.")
+        return True
+
+    def copy_history_item(self, text):
+        with self.clipboard_lock:
+            self.sync.mark_seen(text)
+            pyperclip.copy(text)
+        print(f"Automatically copied most recent item to clipboard: {text}")
+
+    def sync_history_loop(self):
+        """Reconcile the local history cache with the server until the manager stops."""
+        while self.running:
+            self.sync_history()
+            for _ in range(HISTORY_SYNC_INTERVAL):
+                if not self.running:
+                    break
+                time.sleep(1)
+
+    def sync_history(self, full=False):
+        """Fetch history items added since the local cursor and drop items deleted on the server.
+
+        With full, every item is fetched again, for when the server's ids no longer match the local
+        ones (after the user's data moved to another database shard). Sending the local epoch makes
+        the server send everything itself when that happened.
+        """
+        try:
+            cursor = self.history_store.cursor()
+            headers = {"If-None-Match": self.history_etag} if self.history_etag and not full else {}
+            params = {"after_id": 0 if full else cursor or 0}
+            if self.history_store.epoch() is not None:
+                params["epoch"] = self.history_store.epoch()
+            response = requests.get(f"{API_BASE_URL}/api/copied_text_history/{self.username}",
+                                    params=params, headers=headers)
             response.raise_for_status()
+            if response.status_code == 304:
+                return
             data = response.json()
-
-            if data["status"] == "success":
-                self.copied_text_history = data["copied_text_history"]
-                if self.copied_text_history:
-                    most_recent_item = self.copied_text_history[0]
-                    pyperclip.copy(most_recent_item)
-                    print(f"Automatically copied most recent item to clipboard: {most_recent_item}")
-                else:
-                    print("No items in copied text history to copy.")
-                return True
-            else:
+            if data["status"] != "success":
                 print(f"Error: {data['message']}")
-                return False
-        except requests.RequestException as e:
-            print(f"Error: Failed to connect to server: {e}")
-            return False
+                return
+            self.history_etag = response.headers.get("ETag")
+            self.history_store.apply_changes(data["items"], data["ids"], data["cursor"], data.get("epoch"))
+            if not full and self.history_store.missing_ids(data["ids"]):
+                print("Local history is out of step with the server, fetching it again")
+                self.sync_history(full=True)
+                return
+            if cursor is None and data["items"]:
+                # First sync on this machine: restore the most recent item, as a fresh start would
+                self.copy_history_item(self.history_store.most_recent())
+        except Exception as e:
+            # Anything unexpected (a local cache error, an odd response) must not end the sync thread
+            print(f"Error syncing history with server: {e}")
 
     def submit_text_to_server(self, text):
         """Submit text to the server."""
@@ -137,13 +300,12 @@ class ClipboardManager:
             print("Error: Text cannot be empty.")
             return
 
+        submission = self.sync.submission(text)
         try:
-            response = requests.post(
-                f"{API_BASE_URL}/api/submit_copied_text/{self.username}",
-                json={"text": text}
-            )
+            response = requests.post(f"{API_BASE_URL}/api/submit_copied_text/{self.username}", json=submission)
             response.raise_for_status()
             data = response.json()
+            self.sync.submitted(submission, data, time.time())
             if data["status"] == "success":
                 print(f"Text submitted to copied_text_history successfully: {text}")
             else:
@@ -164,6 +326,7 @@ class ClipboardManager:
                     continue
                 self.start_clipboard_monitoring()
                 self.start_polling()
+                self.start_history_sync()
             try:
                 print("Clipboard Manager is running. Press Ctrl+C to exit.")
                 while True:
@@ -0,0 +1,105 @@
+import time
+import uuid
+
+# Clipboard sync state shared by the desktop Clipboard Manager (threads and requests) and the asyncio
+# relay client (httpx): what a device has seen and applied, the requests it sends and the latency it
+# measures. The callers do the HTTP calls and clipboard access.
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in seconds, reported in milliseconds."""
+    BUCKET_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, float("inf")]
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKET_BOUNDS_MS)
+        self.total = 0
+
+    def record(self, seconds):
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(self.BUCKET_BOUNDS_MS):
+            if milliseconds <= bound:
+                self.counts[index] += 1
+                break
+        self.total += 1
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of samples."""
+        threshold = fraction * self.total
+        seen = 0
+        for bound, count in zip(self.BUCKET_BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return self.BUCKET_BOUNDS_MS[-1]
+
+    def summary(self):
+        if not self.total:
+            return "no samples"
+        return (f"{self.total} samples, p50 <= {self.percentile(0.5)} ms, p90 <= {self.percentile(0.9)} ms, "
+                f"p99 <= {self.percentile(0.99)} ms")
+
+# Sync phases timed locally. Phases spanning the server (server_commit, delivery) compare clocks on
+# two machines, so they include any clock offset between them. Noticing a copy isn't timed: the
+# clipboard is only checked once a second, so it adds up to a second before "upload" starts
+SYNC_PHASES = ["upload", "server_commit", "delivery", "apply"]
+
+class ClipboardSync:
+    """One device's view of a user's clipboard sync.
+
+    Callers hold their clipboard lock around local_change() and around mark_seen() plus the copy
+    into the clipboard, so a remote update is never mistaken for a local copy and sent back.
+    """
+
+    def __init__(self, device_id):
+        self.device_id = device_id  # Identifies this device's writes and acks to the server
+        self.last_clipboard_content = None
+        self.last_clipboard_version = 0  # Latest server clipboard version applied locally
+        self.latest_clipboard_etag = None  # Lets unchanged polls come back as 304 Not Modified
+        self.latency = {phase: LatencyHistogram() for phase in SYNC_PHASES}
+
+    def local_change(self, content):
+        """Record the clipboard's current content; True when it is a new local copy to upload."""
+        if content == self.last_clipboard_content or not content.strip():
+            return False
+        self.last_clipboard_content = content
+        return True
+
+    def mark_seen(self, text):
+        """Mark text about to be copied into the clipboard as seen, so it isn't sent back."""
+        self.last_clipboard_content = text
+
+    def poll_params(self):
+        return {"device_id": self.device_id}
+
+    def poll_headers(self):
+        return {"If-None-Match": self.latest_clipboard_etag} if self.latest_clipboard_etag else {}
+
+    def polled(self, etag, data, received_ts):
+        """Take a get_latest_clipboard response; returns (version, text) when it has an update to apply."""
+        self.latest_clipboard_etag = etag
+        if data["status"] != "success" or not data["text"]:
+            return None
+        version = data.get("version", 0)
+        if version <= self.last_clipboard_version:
+            return None
+        if data.get("server_ts"):
+            self.latency["delivery"].record(received_ts - data["server_ts"])
+        return version, data["text"]
+
+    def applied(self, version, received_ts, applied_ts):
+        """Record an update as applied and return the ack_clipboard request body."""
+        self.last_clipboard_version = version
+        self.latency["apply"].record(applied_ts - received_ts)
+        return {"device_id": self.device_id, "version": version, "received_ts": received_ts, "applied_ts": applied_ts}
+
+    def submission(self, text):
+        """Return the submit_copied_text request body for a local copy."""
+        return {"text": text, "device_id": self.device_id, "trace_id": uuid.uuid4().hex, "client_ts": time.time()}
+
+    def submitted(self, submission, data, response_ts):
+        """Record the latency of a submission from its response."""
+        self.latency["upload"].record(response_ts - submission["client_ts"])
+        if data.get("status") == "success" and data.get("server_ts"):
+            self.latency["server_commit"].record(data["server_ts"] - submission["client_ts"])
+
+    def latency_summary(self):
+        return [f"{phase}: {self.latency[phase].summary()}" for phase in SYNC_PHASES]
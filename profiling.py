@@ -0,0 +1,124 @@
+import cProfile
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# On-demand request profiling. A request is profiled when an admin asks for it (X-Profile: 1 header
+# or ?profile=1 on a request made with an admin session) or when it is picked by sampling. Each
+# profile holds cProfile stats plus the timing of every SQL statement the request ran, and the most
+# recent profiles are kept in a ring buffer for the admin dashboard.
+
+# SQL timings of the request being profiled; None when the current request isn't profiled
+current_sql_timings = ContextVar("current_sql_timings", default=None)
+
+# Only one cProfile profiler can be active at a time; requests arriving while it is busy run unprofiled
+profiler_lock = threading.Lock()
+
+# Long-lived or self-referential paths that are never profiled
+UNPROFILED_PATH_PREFIXES = ("/api/stream/", "/admin/profiles", "/static/")
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    if current_sql_timings.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def stop_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    timings = current_sql_timings.get()
+    if timings is not None and conn.info.get("profile_query_start"):
+        timings.append((statement, time.perf_counter() - conn.info["profile_query_start"].pop()))
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests on demand and records them in a ring buffer.
+
+    Must be installed inside SessionMiddleware so the admin session is available. cProfile
+    records everything on the event loop thread while a request is profiled, so overlapping
+    requests can show up in its stats.
+    """
+
+    def __init__(self, app, store, sample_rate=0.0):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate  # Percentage of requests to profile, 0-100
+
+    def profile_trigger(self, scope):
+        """Return why this request should be profiled ("admin" or "sample"), or None."""
+        path = scope["path"]
+        if path.startswith(UNPROFILED_PATH_PREFIXES):
+            return None
+        headers = dict(scope["headers"])
+        query = parse_qs(scope.get("query_string", b"").decode())
+        if headers.get(b"x-profile") == b"1" or query.get("profile") == ["1"]:
+            if scope.get("session", {}).get("user", {}).get("role") == "admin":
+                return "admin"
+        if self.sample_rate and random.random() * 100 < self.sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        trigger = self.profile_trigger(scope) if scope["type"] == "http" else None
+        if not trigger or not profiler_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": None}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        sql_timings = []
+        token = current_sql_timings.set(sql_timings)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                profiler.disable()
+        finally:
+            duration = time.perf_counter() - started
+            current_sql_timings.reset(token)
+            profiler_lock.release()
+            self.store.record(scope, trigger, status["code"], duration, profiler, sql_timings)
+
+class ProfileStore:
+    """Ring buffer of the most recent request profiles."""
+
+    def __init__(self, max_profiles=50):
+        self.profiles = deque(maxlen=max_profiles)
+        self.ids = itertools.count(1)
+
+    def record(self, scope, trigger, status_code, duration, profiler, sql_timings):
+        stats_output = io.StringIO()
+        pstats.Stats(profiler, stream=stats_output).sort_stats("cumulative").print_stats(40)
+        self.profiles.append({
+            "id": next(self.ids),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status_code,
+            "trigger": trigger,
+            "duration_ms": round(duration * 1000, 2),
+            "sql_count": len(sql_timings),
+            "sql_ms": round(sum(seconds for _, seconds in sql_timings) * 1000, 2),
+            "sql": [{"statement": statement, "ms": round(seconds * 1000, 3)} for statement, seconds in sql_timings],
+            "stats": stats_output.getvalue(),
+        })
+
+    def recent(self):
+        """Return the buffered profiles, newest first."""
+        return list(reversed(self.profiles))
+
+    def get(self, profile_id):
+        return next((profile for profile in self.profiles if profile["id"] == profile_id), None)
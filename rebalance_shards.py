@@ -0,0 +1,44 @@
+"""Show how users are spread over the database shards, or move a user to another shard.
+
+Uses the same DATABASE_URLS (or DATABASE_URL) as the server:
+
+    python rebalance_shards.py --status
+    python rebalance_shards.py <username> <target_shard>
+
+Move users while they are idle: writes that reach a server still routing the user to the old shard
+(until its shard directory refreshes, SHARD_DIRECTORY_TTL seconds) are lost.
+"""
+import sys
+
+def print_status(server):
+    counts = [0] * server.shard_router.shard_count
+    for user in server.get_all_users():
+        counts[user["shard"]] += 1
+    for shard, engine in enumerate(server.shard_router.engines):
+        print(f"Shard {shard}: {counts[shard]} users ({engine.url})")
+    overrides = server.load_shard_overrides()
+    print(f"{len(overrides)} users pinned off their hash shard")
+    for username, shard in sorted(overrides.items()):
+        print(f"  {username} -> shard {shard} (hash shard {server.shard_router.hash_shard(username)})")
+
+def main():
+    args = sys.argv[1:]
+    if args != ["--status"] and len(args) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    import server
+
+    if args == ["--status"]:
+        print_status(server)
+        return
+
+    username, target_shard = args[0], int(args[1])
+    if not 0 <= target_shard < server.shard_router.shard_count:
+        print(f"Shard must be between 0 and {server.shard_router.shard_count - 1}")
+        sys.exit(1)
+    if not server.move_user(username, target_shard):
+        print(f"User '{username}' is already on shard {target_shard}")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,39 @@
 import os
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+import asyncio
+import csv
+import hashlib
+import io
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, MetaData, Table
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import bindparam, case, func, inspect, select, text, Column, Float, Index, Integer, String, MetaData, Table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
 from pydantic import BaseModel
+from typing import Optional
 import json
+from storage import ShardRouter, is_neon_pooler
+from write_behind import WriteBehindBuffer
+from profiling import ProfileStore, ProfilingMiddleware
 
 # Initialize FastAPI app
 app = FastAPI()
 
+# Add request profiling middleware (added first so it runs inside SessionMiddleware and can see the admin session).
+# Admins profile a request with the X-Profile: 1 header or ?profile=1; PROFILE_SAMPLE_RATE profiles a
+# percentage of all traffic
+profile_store = ProfileStore(max_profiles=int(os.getenv("PROFILE_BUFFER_SIZE", 50)))
+app.add_middleware(ProfilingMiddleware, store=profile_store,
+                   sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0)))
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -29,15 +50,51 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Set up templates
 templates = Jinja2Templates(directory="templates")
 
-# Database connection (Neon)
-DATABASE_URL = os.getenv("DATABASE_URL").replace("postgresql://", "postgresql+psycopg://")
-if not DATABASE_URL:
+# Database connections (Neon Postgres, or SQLite for single-node installs and test runs).
+# DATABASE_URLS lists several databases, in a fixed order, to shard users across by username;
+# shard 0 also holds the shard directory
+DATABASE_URLS = [url.strip() for url in os.getenv("DATABASE_URLS", os.getenv("DATABASE_URL") or "").split(",")
+                 if url.strip()]
+if not DATABASE_URLS:
     raise ValueError("DATABASE_URL not set")
 
-print(f"Connecting to database with URL: {DATABASE_URL}")
+# Optional read replicas for the polling and history reads: comma-separated URLs for a single
+# database, or one comma-separated group per shard separated by semicolons, in DATABASE_URLS order
+DATABASE_REPLICA_URLS = [[url.strip() for url in group.split(",") if url.strip()]
+                         for group in os.getenv("DATABASE_REPLICA_URLS", "").split(";")]
+if not any(DATABASE_REPLICA_URLS):
+    DATABASE_REPLICA_URLS = []
+
+# Connection pooling: "serverless" on Vercel (small pools, recycled before frozen instances lose
+# their connections), "server" for long-running processes. DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW,
+# DATABASE_POOL_RECYCLE and DATABASE_POOL_TIMEOUT override the mode's Postgres pool settings
+DATABASE_POOL_MODE = os.getenv("DATABASE_POOL_MODE") or ("serverless" if os.getenv("VERCEL") else "server")
+POOL_OVERRIDES = {option: int(os.getenv(variable)) for option, variable in (
+    ("pool_size", "DATABASE_POOL_SIZE"), ("max_overflow", "DATABASE_MAX_OVERFLOW"),
+    ("pool_recycle", "DATABASE_POOL_RECYCLE"), ("pool_timeout", "DATABASE_POOL_TIMEOUT")) if os.getenv(variable)}
+# Executions before psycopg prepares a query server-side; "none" turns prepared statements off for
+# poolers that don't support them (Neon's pooler does)
+DATABASE_PREPARE_THRESHOLD = os.getenv("DATABASE_PREPARE_THRESHOLD", "1")
+PREPARE_THRESHOLD = None if DATABASE_PREPARE_THRESHOLD.lower() == "none" else int(DATABASE_PREPARE_THRESHOLD)
 
 try:
-    engine = create_engine(DATABASE_URL)
+    shard_router = ShardRouter(DATABASE_URLS, load_overrides=lambda: load_shard_overrides(),
+                               directory_ttl=int(os.getenv("SHARD_DIRECTORY_TTL", 30)),
+                               replica_urls=DATABASE_REPLICA_URLS,
+                               pin_seconds=float(os.getenv("REPLICA_PIN_SECONDS", 5)),
+                               max_replica_lag=float(os.getenv("REPLICA_MAX_LAG_SECONDS", 1)),
+                               replica_check_interval=float(os.getenv("REPLICA_CHECK_INTERVAL", 5)),
+                               engine_options=dict(POOL_OVERRIDES, mode=DATABASE_POOL_MODE,
+                                                   prepare_threshold=PREPARE_THRESHOLD))
+    print(f"Database pool mode: {DATABASE_POOL_MODE}")
+    for engine in shard_router.engines:
+        print(f"Connecting to database with URL: {engine.url}")
+        if is_neon_pooler(str(engine.url)):
+            print("Connecting through the Neon pooler")
+    for replicas in filter(None, shard_router.replicas):
+        for replica_engine in replicas.engines:
+            print(f"Reading from replica with URL: {replica_engine.url}")
+    engine = shard_router.engines[0]
     print("Database connection successful")
 except Exception as e:
     print(f"Failed to connect to database: {e}")
@@ -61,6 +118,10 @@ copied_text_history = Table(
     Column("id", Integer, primary_key=True),
     Column("username", String(50), nullable=False),
     Column("text", String, nullable=False),
+    Column("device_id", String(64)),
+    Column("trace_id", String(64)),
+    Column("client_ts", Float),  # Epoch seconds on the submitting client when the text was copied
+    Column("server_ts", Float),  # Epoch seconds on the server when the row was committed
 )
 
 submitted_text_history = Table(
@@ -77,54 +138,475 @@ clipboard_updates = Table(
     Column("id", Integer, primary_key=True),
     Column("username", String(50), nullable=False),
     Column("text", String, nullable=False),
+    Column("version", Integer),  # Per-user clipboard version, increases with every update
+    Column("device_id", String(64)),  # Device that produced the update (None for the web dashboard)
+    Column("trace_id", String(64)),
+    Column("client_ts", Float),
+    Column("server_ts", Float),
+)
+
+# Latest clipboard version each device has applied
+clipboard_devices = Table(
+    "clipboard_devices",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("username", String(50), nullable=False),
+    Column("device_id", String(64), nullable=False),
+    Column("acked_version", Integer, nullable=False),
+    Index("ix_clipboard_devices_username_device_id", "username", "device_id", unique=True),
 )
 
-# Create tables
+# Per-user counters, bumped with a single upsert (see bump_counter)
+user_counters = Table(
+    "user_counters",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("username", String(50), unique=True, nullable=False),
+    Column("clipboard_version", Integer, default=0),  # Latest clipboard version handed out
+    Column("data_version", Integer, default=0),  # Bumped by every write to the user's data
+    Column("history_epoch", Integer, default=0),  # Bumped when a move renumbers the user's history ids
+)
+
+# Timeline of each clipboard update delivered to a device, for sync latency percentiles.
+# Timestamps come from different clocks (submitting client, server, receiving device), so phases
+# that span two machines include their clock offset
+sync_traces = Table(
+    "sync_traces",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("username", String(50), nullable=False),
+    Column("trace_id", String(64)),
+    Column("device_id", String(64), nullable=False),
+    Column("client_ts", Float),
+    Column("server_ts", Float),
+    Column("received_ts", Float),
+    Column("applied_ts", Float),
+)
+
+# Users moved off their hash shard by the rebalancing tool (read from shard 0 only)
+user_shards = Table(
+    "user_shards",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("username", String(50), unique=True, nullable=False),
+    Column("shard", Integer, nullable=False),
+)
+
+# Tables holding per-user rows, copied when a user moves between shards
+USER_TABLES = [users, copied_text_history, submitted_text_history, clipboard_updates, clipboard_devices, sync_traces,
+               user_counters]
+
+# Add columns introduced after a table was first created (create_all only creates missing tables)
+def add_missing_columns(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    print(f"Added column {table.name}.{column.name}")
+
+# Add indexes introduced after a table was first created. Rows that would break a new unique index
+# are dropped first, keeping the newest row for each key
+def add_missing_indexes(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                if index.unique:
+                    newest_ids = select(func.max(table.c.id)).group_by(*index.columns).scalar_subquery()
+                    conn.execute(table.delete().where(table.c.id.not_in(newest_ids)))
+                index.create(conn)
+                print(f"Added index {index.name}")
+
+# Create tables on every shard
 try:
-    metadata.create_all(engine)
+    for shard_engine in shard_router.engines:
+        metadata.create_all(shard_engine)
+        add_missing_columns(shard_engine)
+        add_missing_indexes(shard_engine)
     print("Tables created successfully")
 except Exception as e:
     print(f"Error creating tables: {e}")
     raise
 
-# Set up database session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Hot queries, built once with bound parameters: SQLAlchemy reuses their compiled SQL and psycopg
+# prepares them on the server after their first use on a connection
+USER_BY_NAME = users.select().where(users.c.username == bindparam("username"))
+COPIED_TEXT_NEWEST_FIRST = copied_text_history.select().where(
+    copied_text_history.c.username == bindparam("username")).order_by(copied_text_history.c.id.desc())
+SUBMITTED_TEXT_NEWEST_FIRST = submitted_text_history.select().where(
+    submitted_text_history.c.username == bindparam("username")).order_by(submitted_text_history.c.id.desc())
+LATEST_CLIPBOARD_UPDATE = clipboard_updates.select().where(
+    clipboard_updates.c.username == bindparam("username")).order_by(clipboard_updates.c.id.desc()).limit(1)
+USER_DATA_VERSION = select(user_counters.c.data_version).where(user_counters.c.username == bindparam("username"))
+USER_HISTORY_EPOCH = select(user_counters.c.history_epoch).where(user_counters.c.username == bindparam("username"))
+CLIPBOARD_DEVICE = clipboard_devices.select().where(clipboard_devices.c.username == bindparam("username")).where(
+    clipboard_devices.c.device_id == bindparam("device_id"))
+
+def upsert(db, table):
+    """Return an INSERT for table that accepts on_conflict_do_update on the session's database."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+def bump_counter(db, username, column, floor=0):
+    """Increment one of the user's counters in the current transaction and return its new value.
+
+    The upsert locks the user's counter row until the transaction ends, so concurrent writers get
+    distinct, increasing values. The new value is always above floor (a number or SQL expression).
+    """
+    counter = func.coalesce(user_counters.c[column], 0)
+    statement = upsert(db, user_counters).values(username=username, **{column: floor + 1}).on_conflict_do_update(
+        index_elements=[user_counters.c.username],
+        set_={column: case((counter > floor, counter), else_=floor) + 1},
+    ).returning(user_counters.c[column])
+    return db.execute(statement).scalar_one()
+
+# Set up database sessions: each user's rows live on one shard
+def session_for(username):
+    return shard_router.session_for(username)
+
+# Key pinning the admin user listing to the primaries after a change to the users table
+USERS_LISTING = object()
+
+def read_on(shard, pin_key, read):
+    """Run read(db) on a replica of the shard when one may be used, retrying on the primary if it fails."""
+    db = shard_router.read_session_on(shard, pin_key)
+    try:
+        return read(db)
+    except DBAPIError as e:
+        if not shard_router.replica_failed(db):
+            raise
+        print(f"Replica read failed on shard {shard}, retrying on the primary: {e}")
+    finally:
+        db.close()
+    db = shard_router.session_on(shard)
+    try:
+        return read(db)
+    finally:
+        db.close()
+
+def read_replica(shard, read):
+    """Run read(db) on a healthy replica of the shard; None when there is none or the read fails."""
+    db = shard_router.replica_session_on(shard)
+    if db is None:
+        return None
+    try:
+        return read(db)
+    except DBAPIError as e:
+        shard_router.replica_failed(db)
+        print(f"Replica read failed on shard {shard}, reading from the primary: {e}")
+        return None
+    finally:
+        db.close()
+
+def load_shard_overrides():
+    db = shard_router.session_on(0)
+    try:
+        return {row.username: row.shard for row in db.execute(user_shards.select())}
+    finally:
+        db.close()
+
+def set_shard_override(username, shard):
+    """Pin a username to a shard in the directory, or drop the pin when shard is None or its hash shard."""
+    if shard_router.shard_count == 1:
+        return
+    db = shard_router.session_on(0)
+    try:
+        db.execute(user_shards.delete().where(user_shards.c.username == username))
+        if shard is not None and shard != shard_router.hash_shard(username):
+            db.execute(user_shards.insert().values(username=username, shard=shard))
+        db.commit()
+    finally:
+        db.close()
+    shard_router.refresh_overrides(force=True)
+
+def clear_shard_overrides(usernames):
+    """Drop the directory pins of many usernames in one transaction, e.g. after deleting the users."""
+    usernames = list(usernames)
+    if shard_router.shard_count == 1 or not usernames:
+        return
+    db = shard_router.session_on(0)
+    try:
+        for start in range(0, len(usernames), 1000):
+            db.execute(user_shards.delete().where(user_shards.c.username.in_(usernames[start:start + 1000])))
+        db.commit()
+    finally:
+        db.close()
+    shard_router.refresh_overrides(force=True)
+
+def move_user(username, target_shard):
+    """Copy a user's rows to another shard, route the user there and delete the old rows.
+
+    Writes for the user that arrive during the move, or before other processes reload the shard
+    directory, can land on the old shard and be lost, so move users while they are idle. Rerunning
+    an interrupted move is safe: rows left on the target by the earlier attempt are replaced.
+    """
+    source_shard = shard_router.shard_for(username)
+    if source_shard == target_shard:
+        return False
+    source = shard_router.session_on(source_shard)
+    target = shard_router.session_on(target_shard)
+    try:
+        for table in USER_TABLES:
+            rows = source.execute(table.select().where(table.c.username == username).order_by(table.c.id)).fetchall()
+            target.execute(table.delete().where(table.c.username == username))
+            if rows:
+                # Ids are per shard, so copies get new ones (in the same order)
+                target.execute(table.insert(), [{key: value for key, value in row._mapping.items() if key != "id"}
+                                                for row in rows])
+        # Cursors from the old shard's ids mean nothing on the new one; a new epoch tells clients to resync
+        bump_counter(target, username, "history_epoch")
+        bump_user_version(target, username)
+        target.commit()
+        set_shard_override(username, target_shard)
+        for table in USER_TABLES:
+            source.execute(table.delete().where(table.c.username == username))
+        source.commit()
+    finally:
+        source.close()
+        target.close()
+    shard_router.pin_primary(USERS_LISTING)
+    print(f"Moved user '{username}' from shard {source_shard} to shard {target_shard}")
+    return True
+
+# Optional write-behind mode for copied text submissions: requests are acknowledged once queued in
+# memory and flushed in group commits every WRITE_BEHIND_INTERVAL_MS or WRITE_BEHIND_BATCH_SIZE items
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+if WRITE_BEHIND and DATABASE_POOL_MODE == "serverless":
+    # A frozen serverless instance never flushes the acknowledged rows it holds in memory
+    raise ValueError("WRITE_BEHIND can't be used with DATABASE_POOL_MODE=serverless")
+event_loop = None  # Server event loop, for handing flushed batches back from the write-behind thread
+
+def copied_text_shard(row):
+    return shard_router.shard_for(row["username"])
+
+def flush_copied_text_batch(batch):
+    """Insert queued copied text submissions for one shard in one transaction and trim each affected user's history."""
+    trimmed = {}
+    server_ts = time.time()
+    db = shard_router.session_on(copied_text_shard(batch[0]))
+    try:
+        db.execute(copied_text_history.insert(), [dict(row, server_ts=server_ts) for row in batch])
+        for username in {row["username"] for row in batch}:
+            # Enforce max 10 copied text items
+            items = db.execute(copied_text_history.select().where(copied_text_history.c.username == username).order_by(
+                copied_text_history.c.id)).fetchall()
+            if len(items) > 10:
+                items_to_delete = len(items) - 10
+                db.execute(copied_text_history.delete().where(copied_text_history.c.id.in_(
+                    [item.id for item in items[:items_to_delete]])))
+                trimmed[username] = (items[:items_to_delete], items[items_to_delete:])
+            bump_user_version(db, username)
+        db.commit()
+    finally:
+        db.close()
+    event_loop.call_soon_threadsafe(publish_copied_text_batch, batch, trimmed)
+
+def publish_copied_text_batch(batch, trimmed):
+    for row in batch:
+        publish_event(row["username"], "insert", "copied_text_history", row["text"])
+    for username, (removed_items, kept_items) in trimmed.items():
+        publish_trimmed(username, "copied_text_history", removed_items, kept_items)
+
+copied_text_buffer = WriteBehindBuffer(
+    flush_copied_text_batch,
+    interval=int(os.getenv("WRITE_BEHIND_INTERVAL_MS", 5)) / 1000,
+    max_batch=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500)),
+    group_key=copied_text_shard,  # Shards commit separately, so a failure only retries its own rows
+)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shard_router.stop_replica_checks()
+    if WRITE_BEHIND:
+        copied_text_buffer.stop()
+        print(f"Write-behind buffer stopped: {copied_text_buffer.items_flushed} items in "
+              f"{copied_text_buffer.batches_flushed} batches, {copied_text_buffer.items_dropped} dropped")
 
 # Create default admin and user on startup
 @app.on_event("startup")
 async def startup_event():
-    db = SessionLocal()
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    shard_router.start_replica_checks()
+    if WRITE_BEHIND:
+        copied_text_buffer.start()
+        print("Write-behind mode enabled for copied text submissions")
     try:
         print("Starting database initialization")
-        # Default admin
-        if not db.execute(users.select().where(users.c.username == "admin1")).fetchone():
-            db.execute(users.insert().values(username="admin1", password="adminpass1", role="admin"))
-            print("Default admin created: admin1/adminpass1")
-        else:
-            print("Admin user 'admin1' already exists")
-
-        # Default user
-        if not db.execute(users.select().where(users.c.username == "user1")).fetchone():
-            db.execute(users.insert().values(username="user1", password="userpass1", role="user"))
-            print("Default user created: user1/userpass1")
-        else:
-            print("User 'user1' already exists")
-
-        db.commit()
+        # Default admin and user, each created on its own shard
+        for username, password, role, label in (("admin1", "adminpass1", "admin", "Admin user"),
+                                                ("user1", "userpass1", "user", "User")):
+            db = session_for(username)
+            try:
+                if not db.execute(users.select().where(users.c.username == username)).fetchone():
+                    db.execute(users.insert().values(username=username, password=password, role=role))
+                    db.commit()
+                    print(f"Default {role} created: {username}/{password}")
+                else:
+                    print(f"{label} '{username}' already exists")
+            finally:
+                db.close()
 
         # Log all users to verify
-        all_users = db.execute(users.select()).fetchall()
         print("Users in database on startup:")
-        for user in all_users:
-            print(f"ID: {user.id}, Username: {user.username}, Password: {user.password}, Role: {user.role}")
+        for user in get_all_users():
+            print(f"ID: {user['id']}, Username: {user['username']}, Password: {user['password']}, "
+                  f"Role: {user['role']}, Shard: {user['shard']}")
     except Exception as e:
         print(f"Error during startup: {e}")
+
+# Open dashboard event streams, keyed by username
+stream_subscribers = {}
+# Seconds between checks of a streaming user's data version, for writes made by other server instances
+STREAM_VERSION_CHECK_SECONDS = float(os.getenv("STREAM_VERSION_CHECK_SECONDS", 2))
+
+def publish_event(username, event, table, text=None):
+    """Push a history change (insert, delete or clear) to every open event stream for the user."""
+    message = f"event: {event}\ndata: {json.dumps({'table': table, 'text': text})}\n\n"
+    for queue in stream_subscribers.get(username, ()):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # The client fell too far behind; ask it to reload instead of replaying every change
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait("event: reset\ndata: {}\n\n")
+
+def publish_trimmed(username, table, removed_items, kept_items):
+    """Publish delete events for trimmed rows whose text no longer appears in the kept rows."""
+    kept_texts = {item.text for item in kept_items}
+    for removed_text in {item.text for item in removed_items} - kept_texts:
+        publish_event(username, "delete", table, removed_text)
+
+# Per-user data version (user_counters.data_version), bumped in the transaction of every write;
+# cached read responses are only valid for the version they were built at. Keeping it in the
+# database lets every server process see other processes' writes, and tells whether a replica has
+# caught up with the user's last write
+def bump_user_version(db, username):
+    bump_counter(db, username, "data_version")
+
+def read_data_version(username):
+    """Return the user's data version, read on their primary."""
+    db = session_for(username)
+    try:
+        return db.execute(USER_DATA_VERSION, {"username": username}).scalar() or 0
+    finally:
+        db.close()
+
+def response_entry(version, body):
+    """Return the (version, etag, body) entry for a serialized response."""
+    return (version, '"' + hashlib.sha1(body).hexdigest() + '"', body)
+
+class ResponseCache:
+    """LRU cache of serialized JSON responses keyed by (username, endpoint), bounded by memory use.
+
+    Each entry is charged its key, ETag and body lengths plus ENTRY_OVERHEAD for the Python objects
+    holding them, which dominates for small bodies such as per-device clipboard polls.
+    """
+
+    ENTRY_OVERHEAD = 400  # Bytes per entry for the key and entry tuples, their strings and the dict slot
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # (username, endpoint) -> (version, etag, body)
+        self.lock = threading.Lock()
+
+    def entry_size(self, key, entry):
+        username, endpoint = key
+        return self.ENTRY_OVERHEAD + len(username) + len(endpoint) + len(entry[1]) + len(entry[2])
+
+    def get(self, username, endpoint, version):
+        with self.lock:
+            entry = self.entries.get((username, endpoint))
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end((username, endpoint))
+            return entry
+
+    def put(self, username, endpoint, version, body):
+        """Cache a body built at version and return its entry; an entry for a newer version is kept."""
+        key = (username, endpoint)
+        entry = response_entry(version, body)
+        with self.lock:
+            previous = self.entries.get(key)
+            if previous and previous[0] > version:
+                return entry
+            if previous:
+                del self.entries[key]
+                self.size -= self.entry_size(key, previous)
+            size = self.entry_size(key, entry)
+            if size <= self.max_bytes:
+                self.entries[key] = entry
+                self.size += size
+            while self.size > self.max_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.size -= self.entry_size(evicted_key, evicted)
+        return entry
+
+response_cache = ResponseCache(int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024)))
+
+def etag_response(entry, request):
+    """Return a 304 if the client already has this entry, otherwise the cached JSON body."""
+    _, etag, body = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def cached_entry(username, endpoint, build):
+    """Return the cache entry for a read endpoint while the user's data version is unchanged, else build it.
+
+    The version is read on the primary, so every process sees the user's latest write. A replica
+    runs build(db) only once its own version for the user has caught up to it; otherwise the
+    primary does. The version is read before the data, in the same session, so a body is never
+    cached under a version newer than its data.
+    """
+    shard = shard_router.shard_for(username)
+    db = shard_router.session_on(shard)
+    try:
+        version = db.execute(USER_DATA_VERSION, {"username": username}).scalar() or 0
+        entry = response_cache.get(username, endpoint, version)
+        if entry:
+            return entry
+
+        def build_if_caught_up(replica):
+            if (replica.execute(USER_DATA_VERSION, {"username": username}).scalar() or 0) < version:
+                return None
+            return build(replica)
+
+        content = read_replica(shard, build_if_caught_up)
+        if content is None:
+            content = build(db)
     finally:
         db.close()
+    return response_cache.put(username, endpoint, version, JSONResponse(content=content).body)
+
+def cached_read(request, username, endpoint, build):
+    """Serve a read endpoint from the response cache (see cached_entry), with ETags."""
+    return etag_response(cached_entry(username, endpoint, build), request)
 
 # Pydantic model for history items
 class HistoryItem(BaseModel):
     text: str
+    device_id: Optional[str] = None
+    trace_id: Optional[str] = None  # Client-generated id following the text across devices
+    client_ts: Optional[float] = None  # Epoch seconds when the client picked up the text
+
+# Pydantic model for clipboard update acknowledgments
+class ClipboardAck(BaseModel):
+    device_id: str
+    version: int
+    received_ts: Optional[float] = None  # Epoch seconds when the device fetched the update
+    applied_ts: Optional[float] = None  # Epoch seconds when the update was in the device's clipboard
 
 # Routes
 @app.get("/", response_class=HTMLResponse)
@@ -144,9 +626,9 @@ async def admin_login(request: Request):
 
     print(f"Admin login attempt - Username: {username}, Password: {password}")
 
-    db = SessionLocal()
+    db = session_for(username)
     try:
-        user = db.execute(users.select().where(users.c.username == username)).fetchone()
+        user = db.execute(USER_BY_NAME, {"username": username}).fetchone()
         if user:
             print(f"User found - Username: {user.username}, Password: {user.password}, Role: {user.role}")
             print(f"Comparing password: Input '{password}' vs Stored '{user.password}'")
@@ -154,7 +636,7 @@ async def admin_login(request: Request):
                 print("Login successful, setting session")
                 request.session["user"] = {"username": username, "role": "admin"}
                 return templates.TemplateResponse("admin_dashboard.html",
-                                                  {"request": request, "users": get_all_users(db)})
+                                                  {"request": request, "users": get_all_users()})
             else:
                 print("Login failed: Password or role mismatch")
                 return templates.TemplateResponse("admin_login.html",
@@ -176,12 +658,9 @@ async def admin_dashboard(request: Request):
         print("Admin dashboard access denied: Not authorized")
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    db = SessionLocal()
-    try:
-        print("Serving admin dashboard")
-        return templates.TemplateResponse("admin_dashboard.html", {"request": request, "users": get_all_users(db)})
-    finally:
-        db.close()
+    print("Serving admin dashboard")
+    return templates.TemplateResponse("admin_dashboard.html",
+                                      {"request": request, "users": get_all_users(use_replicas=True)})
 
 @app.post("/admin/add_user")
 async def add_user(request: Request):
@@ -196,31 +675,32 @@ async def add_user(request: Request):
 
     print(f"Adding new user - Username: {username}, Password: {password}, Role: {role}")
 
-    db = SessionLocal()
+    db = session_for(username)
     try:
         # Check if username already exists
-        if db.execute(users.select().where(users.c.username == username)).fetchone():
+        if db.execute(USER_BY_NAME, {"username": username}).fetchone():
             print(f"Add user failed: Username '{username}' already exists")
             return templates.TemplateResponse("admin_dashboard.html", {
                 "request": request,
-                "users": get_all_users(db),
+                "users": get_all_users(),
                 "message": f"Username '{username}' already exists"
             })
 
         # Insert the new user
         db.execute(users.insert().values(username=username, password=password, role=role))
         db.commit()
+        shard_router.pin_primary(USERS_LISTING)
         print("User added successfully")
         return templates.TemplateResponse("admin_dashboard.html", {
             "request": request,
-            "users": get_all_users(db),
+            "users": get_all_users(),
             "message": f"User '{username}' added successfully"
         })
     except Exception as e:
         print(f"Error adding user: {e}")
         return templates.TemplateResponse("admin_dashboard.html", {
             "request": request,
-            "users": get_all_users(db),
+            "users": get_all_users(),
             "message": "Error adding user"
         })
     finally:
@@ -234,21 +714,35 @@ async def update_user(request: Request):
 
     form = await request.form()
     user_id = form.get("user_id")
+    shard = int(form.get("shard") or 0)
     new_username = form.get("username").strip()
     new_password = form.get("password").strip()
 
-    print(f"Updating user - ID: {user_id}, New Username: {new_username}, New Password: {new_password}")
+    print(f"Updating user - ID: {user_id}, Shard: {shard}, New Username: {new_username}, New Password: {new_password}")
 
-    db = SessionLocal()
+    db = shard_router.session_on(shard)
     try:
-        # Check if the new username is already taken by another user
-        existing_user = db.execute(
-            users.select().where(users.c.username == new_username).where(users.c.id != user_id)).fetchone()
+        # Check if the new username is already taken by another user (on whichever shard it routes to)
+        user = db.execute(users.select().where(users.c.id == user_id)).fetchone()
+        existing_user = None
+        if user and new_username != user.username:
+            taken = session_for(new_username)
+            try:
+                existing_user = taken.execute(users.select().where(users.c.username == new_username)).fetchone()
+            finally:
+                taken.close()
+        if not user:
+            print(f"Update user failed: User ID '{user_id}' not found on shard {shard}")
+            return templates.TemplateResponse("admin_dashboard.html", {
+                "request": request,
+                "users": get_all_users(),
+                "message": "User not found"
+            })
         if existing_user:
             print(f"Update user failed: Username '{new_username}' already exists")
             return templates.TemplateResponse("admin_dashboard.html", {
                 "request": request,
-                "users": get_all_users(db),
+                "users": get_all_users(),
                 "message": f"Username '{new_username}' already exists"
             })
 
@@ -258,17 +752,22 @@ async def update_user(request: Request):
             update_values["password"] = new_password
         db.execute(users.update().where(users.c.id == user_id).values(**update_values))
         db.commit()
+        shard_router.pin_primary(USERS_LISTING)
+        if new_username != user.username:
+            # The user's rows stay on this shard, so pin the new name here
+            set_shard_override(new_username, shard)
+            set_shard_override(user.username, None)
         print("User updated successfully")
         return templates.TemplateResponse("admin_dashboard.html", {
             "request": request,
-            "users": get_all_users(db),
+            "users": get_all_users(),
             "message": "User updated successfully"
         })
     except Exception as e:
         print(f"Error updating user: {e}")
         return templates.TemplateResponse("admin_dashboard.html", {
             "request": request,
-            "users": get_all_users(db),
+            "users": get_all_users(),
             "message": "Error updating user"
         })
     finally:
@@ -282,11 +781,12 @@ async def delete_user(request: Request):
 
     form = await request.form()
     user_id = form.get("user_id")
+    shard = int(form.get("shard") or 0)
     current_user = request.session.get("user", {}).get("username")
 
-    print(f"Deleting user - ID: {user_id}")
+    print(f"Deleting user - ID: {user_id}, Shard: {shard}")
 
-    db = SessionLocal()
+    db = shard_router.session_on(shard)
     try:
         # Get the user to be deleted
         user_to_delete = db.execute(users.select().where(users.c.id == user_id)).fetchone()
@@ -294,7 +794,7 @@ async def delete_user(request: Request):
             print(f"Delete user failed: User ID '{user_id}' not found")
             return templates.TemplateResponse("admin_dashboard.html", {
                 "request": request,
-                "users": get_all_users(db),
+                "users": get_all_users(),
                 "message": "User not found"
             })
 
@@ -303,29 +803,303 @@ async def delete_user(request: Request):
             print(f"Delete user failed: Cannot delete the current admin '{current_user}'")
             return templates.TemplateResponse("admin_dashboard.html", {
                 "request": request,
-                "users": get_all_users(db),
+                "users": get_all_users(),
                 "message": "Cannot delete your own account"
             })
 
         # Delete the user
         db.execute(users.delete().where(users.c.id == user_id))
         db.commit()
+        shard_router.pin_primary(USERS_LISTING)
+        set_shard_override(user_to_delete.username, None)
         print(f"User '{user_to_delete.username}' deleted successfully")
         return templates.TemplateResponse("admin_dashboard.html", {
             "request": request,
-            "users": get_all_users(db),
+            "users": get_all_users(),
             "message": f"User '{user_to_delete.username}' deleted successfully"
         })
     except Exception as e:
         print(f"Error deleting user: {e}")
         return templates.TemplateResponse("admin_dashboard.html", {
             "request": request,
-            "users": get_all_users(db),
+            "users": get_all_users(),
             "message": "Error deleting user"
         })
     finally:
         db.close()
 
+@app.get("/admin/profiles", response_class=HTMLResponse)
+async def admin_profiles(request: Request):
+    if request.session.get("user", {}).get("role") != "admin":
+        print("Admin profiles access denied: Not authorized")
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return templates.TemplateResponse("admin_profiles.html",
+                                      {"request": request, "profiles": profile_store.recent(), "profile": None})
+
+@app.get("/admin/profiles/{profile_id}", response_class=HTMLResponse)
+async def admin_profile_detail(profile_id: int, request: Request):
+    if request.session.get("user", {}).get("role") != "admin":
+        print("Admin profiles access denied: Not authorized")
+        raise HTTPException(status_code=403, detail="Not authorized")
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return templates.TemplateResponse("admin_profiles.html",
+                                      {"request": request, "profiles": profile_store.recent(), "profile": profile})
+
+# API endpoint reporting connection pool state and counters for every database, for pool tuning
+@app.get("/admin/pool_stats")
+async def admin_pool_stats(request: Request):
+    if request.session.get("user", {}).get("role") != "admin":
+        print("Pool stats access denied: Not authorized")
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return JSONResponse(content={"status": "success", "mode": DATABASE_POOL_MODE,
+                                 "prepare_threshold": PREPARE_THRESHOLD, "pools": shard_router.pool_stats()})
+
+# Bulk admin operations: each validates every row in one pass, writes in one transaction per shard and
+# returns a per-row report (JSON for JSON requests, otherwise rendered on the admin dashboard)
+USER_ROLES = ("admin", "user")
+
+def bulk_user_rows(data):
+    """Return the user rows of a JSON list or {"users": [...]}; raises ValueError for any other shape."""
+    rows = data.get("users") if isinstance(data, dict) else data
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError("Expected a list of user objects")
+    return rows
+
+def parse_bulk_users(filename, content):
+    """Parse uploaded users from a JSON list (or {"users": [...]}) or a CSV file with a header row."""
+    content = content.strip()
+    if filename.lower().endswith(".json") or content.startswith(("[", "{")):
+        return bulk_user_rows(json.loads(content))
+    return list(csv.DictReader(io.StringIO(content)))
+
+def bulk_usernames(is_json, payload):
+    """Return the usernames of a bulk request, or None when the JSON body isn't a list of strings.
+
+    JSON bodies give {"usernames": [...]} or a bare list; forms give repeated "usernames" fields.
+    """
+    if not is_json:
+        return payload.getlist("usernames")
+    usernames = payload.get("usernames", []) if isinstance(payload, dict) else payload
+    if not isinstance(usernames, list) or not all(isinstance(username, str) for username in usernames):
+        return None
+    return usernames
+
+def group_by_shard(usernames):
+    """Group usernames by the shard that holds them."""
+    groups = defaultdict(set)
+    for username in usernames:
+        groups[shard_router.shard_for(username)].add(username)
+    return groups
+
+def find_existing_usernames(usernames):
+    """Return which of the given usernames already exist, querying each shard in chunks."""
+    existing = set()
+    for shard, shard_usernames in group_by_shard(usernames).items():
+        shard_usernames = list(shard_usernames)
+        db = shard_router.session_on(shard)
+        try:
+            for start in range(0, len(shard_usernames), 1000):
+                chunk = shard_usernames[start:start + 1000]
+                existing.update(row.username for row in db.execute(
+                    users.select().with_only_columns(users.c.username).where(users.c.username.in_(chunk))))
+        finally:
+            db.close()
+    return existing
+
+def write_by_shard(usernames, write):
+    """Run write(db, shard_usernames) on each shard holding some of the usernames, committing per shard.
+
+    A shard that fails is rolled back without stopping the others; returns the usernames on failed shards.
+    """
+    failed = set()
+    for shard, shard_usernames in group_by_shard(usernames).items():
+        db = shard_router.session_on(shard)
+        try:
+            write(db, shard_usernames)
+            db.commit()
+            shard_router.pin_primary(USERS_LISTING)
+        except Exception as e:
+            db.rollback()
+            print(f"Bulk write failed on shard {shard} for {len(shard_usernames)} users: {e}")
+            failed.update(shard_usernames)
+        finally:
+            db.close()
+    return failed
+
+def report_failed_writes(report, failed):
+    """Mark report rows whose shard write failed as errors; returns the status code for the response."""
+    for row in report:
+        if row["username"] in failed and row["status"] != "error":
+            row.update(status="error", message="Database error, not saved")
+    return 500 if failed else 200
+
+def bulk_response(request, is_json, report, message, status_code=200):
+    if is_json:
+        status = "success" if status_code == 200 else "error"
+        return JSONResponse(content={"status": status, "message": message, "report": report}, status_code=status_code)
+    return templates.TemplateResponse("admin_dashboard.html", {
+        "request": request,
+        "users": get_all_users(),
+        "message": message,
+        "report": report
+    })
+
+async def read_bulk_request(request):
+    """Return (is_json, payload) for a JSON body or a submitted form; payload is None for malformed JSON."""
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            return True, await request.json()
+        except ValueError:
+            return True, None
+    return False, await request.form()
+
+@app.post("/admin/bulk_add_users")
+async def bulk_add_users(request: Request):
+    if request.session.get("user", {}).get("role") != "admin":
+        print("Bulk add users access denied: Not authorized")
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    is_json, payload = await read_bulk_request(request)
+    upload = None if is_json else payload.get("file")
+    if not is_json and not hasattr(upload, "read"):
+        return bulk_response(request, is_json, [], "No file uploaded", status_code=400)
+    try:
+        if is_json:
+            rows = bulk_user_rows(payload)
+        else:
+            rows = parse_bulk_users(upload.filename or "", (await upload.read()).decode("utf-8-sig"))
+    except Exception as e:
+        print(f"Error parsing bulk user upload: {e}")
+        return bulk_response(request, is_json, [], "Invalid user list", status_code=400)
+
+    print(f"Bulk adding {len(rows)} users")
+
+    try:
+        # Validate every row first, then insert all valid rows with one executemany per shard
+        report = []
+        new_users = []
+        seen = set()
+        candidates = [str(row.get("username") or "").strip() for row in rows]
+        existing = find_existing_usernames({name for name in candidates if name})
+        for index, row in enumerate(rows, start=1):
+            username = candidates[index - 1]
+            password = str(row.get("password") or "").strip()
+            role = str(row.get("role") or "user").strip()
+            if not username or not password:
+                error = "Username and password are required"
+            elif len(username) > 50 or len(password) > 50:
+                error = "Username and password must be at most 50 characters"
+            elif role not in USER_ROLES:
+                error = f"Invalid role '{role}'"
+            elif username in seen:
+                error = "Duplicate username in upload"
+            elif username in existing:
+                error = "Username already exists"
+            else:
+                error = None
+            seen.add(username)
+            if error:
+                report.append({"row": index, "username": username, "status": "error", "message": error})
+            else:
+                new_users.append({"username": username, "password": password, "role": role})
+                report.append({"row": index, "username": username, "status": "created", "message": "User created"})
+
+        new_users_by_name = {user["username"]: user for user in new_users}
+        failed = write_by_shard(new_users_by_name, lambda db, shard_usernames: db.execute(
+            users.insert(), [new_users_by_name[username] for username in shard_usernames]))
+        status_code = report_failed_writes(report, failed)
+        created = len(new_users) - len(failed)
+        print(f"Bulk add finished: {created} of {len(rows)} users created")
+        return bulk_response(request, is_json, report, f"{created} of {len(rows)} users added", status_code=status_code)
+    except Exception as e:
+        print(f"Error bulk adding users: {e}")
+        return bulk_response(request, is_json, [], "Error adding users", status_code=500)
+
+@app.post("/admin/bulk_delete_users")
+async def bulk_delete_users(request: Request):
+    if request.session.get("user", {}).get("role") != "admin":
+        print("Bulk delete users access denied: Not authorized")
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    is_json, payload = await read_bulk_request(request)
+    usernames = bulk_usernames(is_json, payload)
+    if usernames is None:
+        return bulk_response(request, is_json, [], "Invalid user list", status_code=400)
+    current_user = request.session.get("user", {}).get("username")
+
+    print(f"Bulk deleting {len(usernames)} users")
+
+    try:
+        existing = find_existing_usernames(usernames)
+        report = []
+        to_delete = set()
+        for index, username in enumerate(usernames, start=1):
+            if username not in existing:
+                report.append({"row": index, "username": username, "status": "error", "message": "User not found"})
+            elif username == current_user:
+                report.append({"row": index, "username": username, "status": "error",
+                               "message": "Cannot delete your own account"})
+            else:
+                to_delete.add(username)
+                report.append({"row": index, "username": username, "status": "deleted", "message": "User deleted"})
+
+        failed = write_by_shard(to_delete, lambda db, shard_usernames: db.execute(
+            users.delete().where(users.c.username.in_(shard_usernames))))
+        clear_shard_overrides(to_delete - failed)
+        status_code = report_failed_writes(report, failed)
+        print(f"Bulk delete finished: {len(to_delete - failed)} users deleted")
+        return bulk_response(request, is_json, report, f"{len(to_delete - failed)} users deleted",
+                             status_code=status_code)
+    except Exception as e:
+        print(f"Error bulk deleting users: {e}")
+        return bulk_response(request, is_json, [], "Error deleting users", status_code=500)
+
+@app.post("/admin/bulk_update_role")
+async def bulk_update_role(request: Request):
+    if request.session.get("user", {}).get("role") != "admin":
+        print("Bulk update role access denied: Not authorized")
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    is_json, payload = await read_bulk_request(request)
+    # The role goes with the usernames, so a JSON body must be an object
+    usernames = bulk_usernames(is_json, payload) if not is_json or isinstance(payload, dict) else None
+    if usernames is None:
+        return bulk_response(request, is_json, [], "Invalid user list", status_code=400)
+    role = payload.get("role") or ""
+    if not isinstance(role, str) or role.strip() not in USER_ROLES:
+        return bulk_response(request, is_json, [], f"Invalid role '{role}'", status_code=400)
+    role = role.strip()
+    current_user = request.session.get("user", {}).get("username")
+
+    print(f"Bulk changing role of {len(usernames)} users to {role}")
+
+    try:
+        existing = find_existing_usernames(usernames)
+        report = []
+        to_update = set()
+        for index, username in enumerate(usernames, start=1):
+            if username not in existing:
+                report.append({"row": index, "username": username, "status": "error", "message": "User not found"})
+            elif username == current_user:
+                report.append({"row": index, "username": username, "status": "error",
+                               "message": "Cannot change your own role"})
+            else:
+                to_update.add(username)
+                report.append({"row": index, "username": username, "status": "updated",
+                               "message": f"Role set to {role}"})
+
+        failed = write_by_shard(to_update, lambda db, shard_usernames: db.execute(
+            users.update().where(users.c.username.in_(shard_usernames)).values(role=role)))
+        status_code = report_failed_writes(report, failed)
+        print(f"Bulk role change finished: {len(to_update - failed)} users updated")
+        return bulk_response(request, is_json, report, f"{len(to_update - failed)} users updated",
+                             status_code=status_code)
+    except Exception as e:
+        print(f"Error bulk updating roles: {e}")
+        return bulk_response(request, is_json, [], "Error updating roles", status_code=500)
+
 @app.get("/user/login", response_class=HTMLResponse)
 async def user_login_page(request: Request, error: str = None):
     print("Serving user login page")
@@ -339,9 +1113,9 @@ async def user_login(request: Request):
 
     print(f"User login attempt - Username: {username}, Password: {password}")
 
-    db = SessionLocal()
+    db = session_for(username)
     try:
-        user = db.execute(users.select().where(users.c.username == username)).fetchone()
+        user = db.execute(USER_BY_NAME, {"username": username}).fetchone()
         if user:
             print(f"User found - Username: {user.username}, Password: {user.password}, Role: {user.role}")
             print(f"Comparing password: Input '{password}' vs Stored '{user.password}'")
@@ -390,9 +1164,9 @@ async def authenticate_user(request: Request):
 
         print(f"API authenticate attempt - Username: {username}, Password: {password}")
 
-        db = SessionLocal()
+        db = session_for(username)
         try:
-            user = db.execute(users.select().where(users.c.username == username)).fetchone()
+            user = db.execute(USER_BY_NAME, {"username": username}).fetchone()
             if user and user.password == password:
                 print(f"API authentication successful for user: {username}")
                 return JSONResponse(content={"status": "success", "username": username, "role": user.role})
@@ -410,43 +1184,71 @@ async def authenticate_user(request: Request):
         return JSONResponse(content={"status": "error", "message": "Invalid request format"}, status_code=400)
 
 # API endpoint to fetch copied text history for a user (Text Viewer)
+# With after_id (the cursor from a previous call), only newer items are returned in "items", along with the
+# ids of every item still on the server so the caller can drop deleted ones. Ids change when the user moves
+# to another shard, which bumps "epoch": a cursor sent with an older epoch gets every item back
 @app.get("/api/copied_text_history/{username}")
-async def get_copied_text_history(username: str, request: Request = None):
-    db = SessionLocal()
+async def get_copied_text_history(username: str, request: Request, after_id: int = None, epoch: int = None):
+    def build(db):
+        copied_text_items = db.execute(COPIED_TEXT_NEWEST_FIRST, {"username": username}).fetchall()
+        return {
+            "status": "success",
+            "copied_text_history": [item.text for item in copied_text_items],
+            "items": [{"id": item.id, "text": item.text} for item in copied_text_items],
+            "cursor": copied_text_items[0].id if copied_text_items else 0,
+            "epoch": db.execute(USER_HISTORY_EPOCH, {"username": username}).scalar() or 0
+        }
+
     try:
-        copied_text_items = db.execute(
-            copied_text_history.select().where(copied_text_history.c.username == username).order_by(
-                copied_text_history.c.id.desc())).fetchall()
-        return JSONResponse(content={
+        if after_id is None:
+            return cached_read(request, username, "copied_text_history", build)
+        # Changes since a cursor are taken from the cached full history instead of being cached per
+        # cursor value, since each cursor is only asked for until the next change
+        version, _, body = cached_entry(username, "copied_text_history", build)
+        history = json.loads(body)
+        items = history["items"]
+        newest = items[0]["id"] if items else None
+        # A cursor from another epoch, or (for callers not sending the epoch) above every current id,
+        # comes from before the user moved shards: send everything
+        moved = history["epoch"] != epoch if epoch is not None else newest is not None and newest < after_id
+        newer_than = 0 if moved else after_id
+        cursor = newest if newest is not None else newer_than
+        changes = {
             "status": "success",
-            "copied_text_history": [item.text for item in copied_text_items]
-        })
+            "items": [item for item in items if item["id"] > newer_than],
+            "ids": [item["id"] for item in items],
+            "cursor": cursor,
+            "epoch": history["epoch"]
+        }
+        return etag_response(response_entry(version, JSONResponse(content=changes).body), request)
     except Exception as e:
         print(f"Error fetching copied text history for {username}: {e}")
         return JSONResponse(content={"status": "error", "message": "Error fetching copied text history"}, status_code=500)
-    finally:
-        db.close()
 
 # API endpoint to submit text to clipboard (from Clipboard Manager)
 @app.post("/api/submit_to_clipboard/{username}")
 async def submit_to_clipboard(username: str, item: HistoryItem, request: Request):
     if "user" not in request.session or request.session["user"]["username"] != username:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db = SessionLocal()
+    db = session_for(username)
     try:
+        # The counter row serializes concurrent updates, which get distinct, increasing versions. The
+        # floor keeps versions above those stored before the counter existed
+        stored_version = select(func.coalesce(func.max(clipboard_updates.c.version), 0)).where(
+            clipboard_updates.c.username == username).scalar_subquery()
+        version = bump_counter(db, username, "clipboard_version", floor=stored_version)
         # Store the text in clipboard_updates table
-        db.execute(clipboard_updates.insert().values(username=username, text=item.text))
-        db.commit()
+        server_ts = time.time()
+        result = db.execute(clipboard_updates.insert().values(username=username, text=item.text, version=version,
+                                                              device_id=item.device_id, trace_id=item.trace_id,
+                                                              client_ts=item.client_ts, server_ts=server_ts))
         # Enforce only the latest text (delete older entries)
-        items = db.execute(clipboard_updates.select().where(clipboard_updates.c.username == username).order_by(clipboard_updates.c.id)).fetchall()
-        if len(items) > 1:
-            items_to_delete = len(items) - 1
-            db.execute(clipboard_updates.delete().where(clipboard_updates.c.username == username).where(
-                clipboard_updates.c.id.in_(
-                    [item.id for item in items[:items_to_delete]]
-                )))
-            db.commit()
-        return JSONResponse(content={"status": "success", "message": "Text sent to clipboard"})
+        db.execute(clipboard_updates.delete().where(clipboard_updates.c.username == username).where(
+            clipboard_updates.c.id != result.inserted_primary_key[0]))
+        bump_user_version(db, username)
+        db.commit()
+        return JSONResponse(content={"status": "success", "message": "Text sent to clipboard", "version": version,
+                                     "server_ts": server_ts})
     except Exception as e:
         print(f"Error submitting text to clipboard for {username}: {e}")
         return JSONResponse(content={"status": "error", "message": "Error submitting text to clipboard"}, status_code=500)
@@ -454,39 +1256,102 @@ async def submit_to_clipboard(username: str, item: HistoryItem, request: Request
         db.close()
 
 # API endpoint to get the latest clipboard text (for polling)
+# When device_id is given, updates that device produced or already acknowledged come back with empty text
 @app.get("/api/get_latest_clipboard/{username}")
-async def get_latest_clipboard(username: str):
-    db = SessionLocal()
-    try:
-        latest_item = db.execute(
-            clipboard_updates.select().where(clipboard_updates.c.username == username).order_by(
-                clipboard_updates.c.id.desc())).first()
-        if latest_item:
-            return JSONResponse(content={"status": "success", "text": latest_item.text})
-        return JSONResponse(content={"status": "success", "text": ""})
+async def get_latest_clipboard(username: str, request: Request, device_id: str = None):
+    # Responses differ per device, so each device gets its own cache entry
+    endpoint = f"get_latest_clipboard:{device_id or ''}"
+
+    def build(db):
+        latest_item = db.execute(LATEST_CLIPBOARD_UPDATE, {"username": username}).first()
+        if not latest_item:
+            return {"status": "success", "text": "", "version": 0}
+        clipboard_version = latest_item.version or 0
+        if device_id:
+            if latest_item.device_id == device_id:
+                return {"status": "success", "text": "", "version": clipboard_version}
+            device = db.execute(CLIPBOARD_DEVICE, {"username": username, "device_id": device_id}).first()
+            if device and device.acked_version >= clipboard_version:
+                return {"status": "success", "text": "", "version": clipboard_version}
+        return {
+            "status": "success",
+            "text": latest_item.text,
+            "version": clipboard_version,
+            "device_id": latest_item.device_id,
+            "trace_id": latest_item.trace_id,
+            "client_ts": latest_item.client_ts,
+            "server_ts": latest_item.server_ts
+        }
+
+    try:
+        return cached_read(request, username, endpoint, build)
     except Exception as e:
         print(f"Error fetching latest clipboard text for {username}: {e}")
         return JSONResponse(content={"status": "error", "message": "Error fetching latest clipboard text"}, status_code=500)
+
+def record_sync_trace(db, username, ack):
+    """Store the delivery timeline of an acknowledged clipboard update, keeping the latest 500 per user."""
+    update = db.execute(clipboard_updates.select().where(clipboard_updates.c.username == username).where(
+        clipboard_updates.c.version == ack.version)).first()
+    if not update:
+        return  # Already replaced by a newer update
+    db.execute(sync_traces.insert().values(
+        username=username, trace_id=update.trace_id, device_id=ack.device_id, client_ts=update.client_ts,
+        server_ts=update.server_ts, received_ts=ack.received_ts, applied_ts=ack.applied_ts))
+    recent_ids = sync_traces.select().with_only_columns(sync_traces.c.id).where(
+        sync_traces.c.username == username).order_by(sync_traces.c.id.desc()).limit(500)
+    db.execute(sync_traces.delete().where(sync_traces.c.username == username).where(
+        sync_traces.c.id.not_in(recent_ids)))
+
+# API endpoint to acknowledge a clipboard update (used by the desktop app after applying it)
+@app.post("/api/ack_clipboard/{username}")
+async def ack_clipboard(username: str, ack: ClipboardAck):
+    db = session_for(username)
+    try:
+        # Acked versions only move forward, also when acks for one device race
+        acked_version = clipboard_devices.c.acked_version
+        db.execute(upsert(db, clipboard_devices).values(
+            username=username, device_id=ack.device_id, acked_version=ack.version).on_conflict_do_update(
+            index_elements=[clipboard_devices.c.username, clipboard_devices.c.device_id],
+            set_={"acked_version": case((acked_version < ack.version, ack.version), else_=acked_version)}))
+        if ack.applied_ts:
+            record_sync_trace(db, username, ack)
+        bump_user_version(db, username)
+        db.commit()
+        return JSONResponse(content={"status": "success", "message": "Clipboard update acknowledged"})
+    except Exception as e:
+        print(f"Error acknowledging clipboard update for {username}: {e}")
+        return JSONResponse(content={"status": "error", "message": "Error acknowledging clipboard update"}, status_code=500)
     finally:
         db.close()
 
 # API endpoint to submit new copied text (used by the desktop app)
 @app.post("/api/submit_copied_text/{username}")
 async def submit_copied_text(username: str, item: HistoryItem):
-    db = SessionLocal()
+    if WRITE_BEHIND:
+        copied_text_buffer.submit({"username": username, "text": item.text, "device_id": item.device_id,
+                                   "trace_id": item.trace_id, "client_ts": item.client_ts})
+        return JSONResponse(content={"status": "success", "message": "Copied text submitted"})
+    db = session_for(username)
     try:
-        db.execute(copied_text_history.insert().values(username=username, text=item.text))
-        db.commit()
+        server_ts = time.time()
+        db.execute(copied_text_history.insert().values(username=username, text=item.text, device_id=item.device_id,
+                                                       trace_id=item.trace_id, client_ts=item.client_ts,
+                                                       server_ts=server_ts))
         # Enforce max 10 copied text items
         items = db.execute(copied_text_history.select().where(copied_text_history.c.username == username).order_by(copied_text_history.c.id)).fetchall()
-        if len(items) > 10:
-            items_to_delete = len(items) - 10
+        items_to_delete = max(len(items) - 10, 0)
+        if items_to_delete:
             db.execute(copied_text_history.delete().where(copied_text_history.c.username == username).where(
                 copied_text_history.c.id.in_(
                     [item.id for item in items[:items_to_delete]]
                 )))
-            db.commit()
-        return JSONResponse(content={"status": "success", "message": "Copied text submitted"})
+        bump_user_version(db, username)
+        db.commit()
+        if items_to_delete:
+            publish_trimmed(username, "copied_text_history", items[:items_to_delete], items[items_to_delete:])
+        publish_event(username, "insert", "copied_text_history", item.text)
+        return JSONResponse(content={"status": "success", "message": "Copied text submitted", "server_ts": server_ts})
     except Exception as e:
         print(f"Error submitting copied text for {username}: {e}")
         return JSONResponse(content={"status": "error", "message": "Error submitting data"}, status_code=500)
@@ -498,11 +1363,13 @@ async def submit_copied_text(username: str, item: HistoryItem):
 async def delete_copied_text(username: str, item: HistoryItem, request: Request):
     if "user" not in request.session or request.session["user"]["username"] != username:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db = SessionLocal()
+    db = session_for(username)
     try:
         db.execute(copied_text_history.delete().where(copied_text_history.c.username == username).where(
             copied_text_history.c.text == item.text))
+        bump_user_version(db, username)
         db.commit()
+        publish_event(username, "delete", "copied_text_history", item.text)
         return JSONResponse(content={"status": "success", "message": "Copied text item deleted"})
     except Exception as e:
         print(f"Error deleting copied text for {username}: {e}")
@@ -515,10 +1382,12 @@ async def delete_copied_text(username: str, item: HistoryItem, request: Request)
 async def clear_copied_text(username: str, request: Request):
     if "user" not in request.session or request.session["user"]["username"] != username:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db = SessionLocal()
+    db = session_for(username)
     try:
         db.execute(copied_text_history.delete().where(copied_text_history.c.username == username))
+        bump_user_version(db, username)
         db.commit()
+        publish_event(username, "clear", "copied_text_history")
         return JSONResponse(content={"status": "success", "message": "Copied text history cleared"})
     except Exception as e:
         print(f"Error clearing copied text for {username}: {e}")
@@ -531,39 +1400,40 @@ async def clear_copied_text(username: str, request: Request):
 async def get_submitted_text_history(username: str, request: Request):
     if "user" not in request.session or request.session["user"]["username"] != username:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db = SessionLocal()
-    try:
-        submitted_text_items = db.execute(
-            submitted_text_history.select().where(submitted_text_history.c.username == username).order_by(
-                submitted_text_history.c.id.desc())).fetchall()
-        return JSONResponse(content={
+    def build(db):
+        submitted_text_items = db.execute(SUBMITTED_TEXT_NEWEST_FIRST, {"username": username}).fetchall()
+        return {
             "status": "success",
             "submitted_text_history": [item.text for item in submitted_text_items]
-        })
+        }
+
+    try:
+        return cached_read(request, username, "submitted_text_history", build)
     except Exception as e:
         print(f"Error fetching submitted text history for {username}: {e}")
         return JSONResponse(content={"status": "error", "message": "Error fetching submitted text history"}, status_code=500)
-    finally:
-        db.close()
 
 # API endpoint to submit new submitted text (Clipboard Manager history)
 @app.post("/api/submit_submitted_text/{username}")
 async def submit_submitted_text(username: str, item: HistoryItem, request: Request):
     if "user" not in request.session or request.session["user"]["username"] != username:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db = SessionLocal()
+    db = session_for(username)
     try:
         db.execute(submitted_text_history.insert().values(username=username, text=item.text))
-        db.commit()
         # Enforce max 10 submitted text items
         items = db.execute(submitted_text_history.select().where(submitted_text_history.c.username == username).order_by(submitted_text_history.c.id)).fetchall()
-        if len(items) > 10:
-            items_to_delete = len(items) - 10
+        items_to_delete = max(len(items) - 10, 0)
+        if items_to_delete:
             db.execute(submitted_text_history.delete().where(submitted_text_history.c.username == username).where(
                 submitted_text_history.c.id.in_(
                     [item.id for item in items[:items_to_delete]]
                 )))
-            db.commit()
+        bump_user_version(db, username)
+        db.commit()
+        if items_to_delete:
+            publish_trimmed(username, "submitted_text_history", items[:items_to_delete], items[items_to_delete:])
+        publish_event(username, "insert", "submitted_text_history", item.text)
         return JSONResponse(content={"status": "success", "message": "Submitted text added to history"})
     except Exception as e:
         print(f"Error submitting submitted text for {username}: {e}")
@@ -576,11 +1446,13 @@ async def submit_submitted_text(username: str, item: HistoryItem, request: Reque
 async def delete_submitted_text(username: str, item: HistoryItem, request: Request):
     if "user" not in request.session or request.session["user"]["username"] != username:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db = SessionLocal()
+    db = session_for(username)
     try:
         db.execute(submitted_text_history.delete().where(submitted_text_history.c.username == username).where(
             submitted_text_history.c.text == item.text))
+        bump_user_version(db, username)
         db.commit()
+        publish_event(username, "delete", "submitted_text_history", item.text)
         return JSONResponse(content={"status": "success", "message": "Submitted text item deleted"})
     except Exception as e:
         print(f"Error deleting submitted text for {username}: {e}")
@@ -593,10 +1465,12 @@ async def delete_submitted_text(username: str, item: HistoryItem, request: Reque
 async def clear_submitted_text(username: str, request: Request):
     if "user" not in request.session or request.session["user"]["username"] != username:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db = SessionLocal()
+    db = session_for(username)
     try:
         db.execute(submitted_text_history.delete().where(submitted_text_history.c.username == username))
+        bump_user_version(db, username)
         db.commit()
+        publish_event(username, "clear", "submitted_text_history")
         return JSONResponse(content={"status": "success", "message": "Submitted text history cleared"})
     except Exception as e:
         print(f"Error clearing submitted text for {username}: {e}")
@@ -604,6 +1478,109 @@ async def clear_submitted_text(username: str, request: Request):
     finally:
         db.close()
 
-# Helper function to get all users for admin dashboard
-def get_all_users(db):
-    return db.execute(users.select()).fetchall()
\ No newline at end of file
+def latency_percentiles(samples):
+    """Nearest-rank p50/p90/p99 of samples given in seconds, reported in milliseconds."""
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+    summary = {"count": len(samples)}
+    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        summary[name] = round(samples[max(math.ceil(fraction * len(samples)) - 1, 0)] * 1000, 1)
+    return summary
+
+# API endpoint summarizing clipboard propagation latency for a user (submit -> server -> device clipboard)
+@app.get("/api/sync_latency/{username}")
+async def get_sync_latency(username: str, request: Request):
+    session_user = request.session.get("user", {})
+    if session_user.get("username") != username and session_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    db = session_for(username)
+    try:
+        traces = db.execute(sync_traces.select().where(sync_traces.c.username == username)).fetchall()
+        phases = {
+            "upload": lambda trace: trace.server_ts - trace.client_ts,
+            "delivery": lambda trace: trace.received_ts - trace.server_ts,
+            "apply": lambda trace: trace.applied_ts - trace.received_ts,
+            "total": lambda trace: trace.applied_ts - trace.client_ts,
+        }
+        summary = {}
+        for phase, duration in phases.items():
+            samples = []
+            for trace in traces:
+                try:
+                    samples.append(duration(trace))
+                except TypeError:
+                    pass  # Timestamp not reported for this trace
+            summary[phase] = latency_percentiles(samples)
+        return JSONResponse(content={"status": "success", "traces": len(traces), "latency_ms": summary})
+    except Exception as e:
+        print(f"Error fetching sync latency for {username}: {e}")
+        return JSONResponse(content={"status": "error", "message": "Error fetching sync latency"}, status_code=500)
+    finally:
+        db.close()
+
+# API endpoint streaming history changes to the dashboard (Server-Sent Events)
+@app.get("/api/stream/{username}")
+async def stream_history_events(username: str, request: Request):
+    if "user" not in request.session or request.session["user"]["username"] != username:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    # Events are only published by the process handling the write, so the stream also watches the
+    # user's data version and sends a reset when it changes without a local event, i.e. when
+    # another server instance wrote. A remote write in the same interval as a local event is only
+    # picked up by the dashboard's fallback reload
+    async def event_stream():
+        queue = asyncio.Queue(maxsize=100)
+        stream_subscribers.setdefault(username, set()).add(queue)
+        try:
+            yield "retry: 3000\n\n"
+            seen_version = await asyncio.to_thread(read_data_version, username)
+            local_events = False
+            next_check = time.monotonic() + STREAM_VERSION_CHECK_SECONDS
+            last_sent = time.monotonic()
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=max(next_check - time.monotonic(), 0))
+                    local_events = True
+                    last_sent = time.monotonic()
+                    yield message
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+                version = await asyncio.to_thread(read_data_version, username)
+                if version != seen_version and not local_events:
+                    last_sent = time.monotonic()
+                    yield "event: reset\ndata: {}\n\n"
+                seen_version, local_events = version, False
+                next_check = time.monotonic() + STREAM_VERSION_CHECK_SECONDS
+                if time.monotonic() - last_sent >= 15:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"  # Keeps proxies from closing an idle stream
+        finally:
+            subscribers = stream_subscribers.get(username, set())
+            subscribers.discard(queue)
+            if not subscribers:
+                stream_subscribers.pop(username, None)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Helper function to get all users for admin dashboard, gathered from every shard. Pages rendered
+# right after an admin change read the primaries; use_replicas lets plain page loads use replicas
+def get_all_users(use_replicas=False):
+    def shard_users(shard):
+        def load(db):
+            return [dict(row._mapping, shard=shard) for row in db.execute(users.select().order_by(users.c.id))]
+        if use_replicas:
+            return read_on(shard, USERS_LISTING, load)
+        db = shard_router.session_on(shard)
+        try:
+            return load(db)
+        finally:
+            db.close()
+
+    shards = range(shard_router.shard_count)
+    if shard_router.shard_count == 1:
+        return shard_users(0)
+    with ThreadPoolExecutor(max_workers=shard_router.shard_count) as executor:
+        return [user for users_on_shard in executor.map(shard_users, shards) for user in users_on_shard]
\ No newline at end of file
@@ -15,8 +15,28 @@ errorMessage.className = 'error';
 clipboardManagerSection.appendChild(errorMessage);
 
 const username = document.querySelector('header p').textContent.split(': ')[1];
-let pollingInterval = null; // For polling the copied text history
-let lastCopiedTextHash = ''; // To avoid unnecessary UI updates in Text Viewer
+let eventSource = null; // Live history updates from the server
+let eventStreamOpened = false; // Set after the first connection, so reconnects trigger a reload
+let lastEventTime = Date.now(); // Last live event or reload, for the fallback reload
+const FALLBACK_RELOAD_MS = 30000; // Reload when no event arrived for this long
+const historyEtags = {}; // Last ETag per history URL, so unchanged reloads come back as 304
+
+// Fetch a history URL, resolving to null when it hasn't changed since the last load
+async function fetchHistory(url) {
+    const headers = historyEtags[url] ? { 'If-None-Match': historyEtags[url] } : {};
+    const response = await fetch(url, { credentials: 'include', cache: 'no-store', headers });
+    if (response.status === 304) {
+        return null;
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP error! Status: ${response.status}`);
+    }
+    const data = await response.json();
+    if (data.status === 'success') {
+        historyEtags[url] = response.headers.get('ETag');
+    }
+    return data;
+}
 
 // Toggle Sections
 function showClipboardManager() {
@@ -25,11 +45,6 @@ function showClipboardManager() {
     clipboardManagerBtn.classList.add('active');
     copiedTextBtn.classList.remove('active');
     loadSubmittedTextHistory(); // Load submitted text history when tab is opened
-    // Stop polling when leaving the Copied Text Viewer
-    if (pollingInterval) {
-        clearInterval(pollingInterval);
-        pollingInterval = null;
-    }
 }
 
 function showCopiedText() {
@@ -38,10 +53,6 @@ function showCopiedText() {
     clipboardManagerBtn.classList.remove('active');
     copiedTextBtn.classList.add('active');
     loadCopiedText(); // Load copied text when tab is opened
-    // Start polling to refresh the copied text history every 3 seconds
-    if (!pollingInterval) {
-        pollingInterval = setInterval(loadCopiedText, 3000); // Polling every 3 seconds
-    }
 }
 
 clipboardManagerBtn.addEventListener('click', showClipboardManager);
@@ -50,21 +61,15 @@ copiedTextBtn.addEventListener('click', showCopiedText);
 // Load submitted text history (Clipboard Manager)
 async function loadSubmittedTextHistory() {
     try {
-        const response = await fetch(`/api/submitted_text_history/${username}`, {
-            credentials: 'include',
-        });
-        if (!response.ok) {
-            throw new Error(`HTTP error! Status: ${response.status}`);
+        const data = await fetchHistory(`/api/submitted_text_history/${username}`);
+        if (data === null) {
+            return; // Unchanged since the last load
         }
-        const data = await response.json();
         if (data.status === 'success') {
             historyList.innerHTML = '';
             const submittedHistory = data.submitted_text_history || [];
             if (submittedHistory.length === 0) {
-                const emptyItem = document.createElement('li');
-                emptyItem.textContent = 'No submitted text yet...';
-                emptyItem.className = 'text-gray-500';
-                historyList.appendChild(emptyItem);
+                showEmptyMessage(historyList);
             } else {
                 submittedHistory.forEach(item => addToSubmittedTextHistory(item));
             }
@@ -80,28 +85,18 @@ async function loadSubmittedTextHistory() {
 // Load copied text history (Text Viewer)
 async function loadCopiedText() {
     try {
-        const response = await fetch(`/api/copied_text_history/${username}`, {
-            credentials: 'include',
-        });
-        if (!response.ok) {
-            throw new Error(`HTTP error! Status: ${response.status}`);
+        const data = await fetchHistory(`/api/copied_text_history/${username}`);
+        if (data === null) {
+            return; // Unchanged since the last load
         }
-        const data = await response.json();
         if (data.status === 'success') {
             const copiedTextHistory = data.copied_text_history || [];
-            const currentHash = copiedTextHistory.join('|'); // Create a hash of the current history
-            if (currentHash !== lastCopiedTextHash) { // Only update UI if data has changed
-                lastCopiedTextHash = currentHash;
-                copiedTextList.innerHTML = ''; // Clear existing items to avoid duplication
-                if (copiedTextHistory.length === 0) {
-                    const emptyItem = document.createElement('li');
-                    emptyItem.textContent = 'No copied text yet...';
-                    emptyItem.className = 'text-gray-500';
-                    copiedTextList.appendChild(emptyItem);
-                } else {
-                    // Add items in order (latest first)
-                    copiedTextHistory.forEach(item => addToCopiedText(item));
-                }
+            copiedTextList.innerHTML = ''; // Clear existing items to avoid duplication
+            if (copiedTextHistory.length === 0) {
+                showEmptyMessage(copiedTextList);
+            } else {
+                // Add items in order (latest first)
+                copiedTextHistory.forEach(item => addToCopiedText(item));
             }
         } else {
             throw new Error(data.message || 'Failed to load copied text');
@@ -112,6 +107,27 @@ async function loadCopiedText() {
     }
 }
 
+// Show the placeholder item for an empty list
+function showEmptyMessage(list) {
+    const emptyItem = document.createElement('li');
+    emptyItem.textContent = list === historyList ? 'No submitted text yet...' : 'No copied text yet...';
+    emptyItem.className = 'text-gray-500';
+    list.appendChild(emptyItem);
+}
+
+// Remove the item with the given text from a list
+function removeFromList(list, text) {
+    for (let item of list.getElementsByTagName('li')) {
+        if (item.querySelector('span') && item.querySelector('span').textContent === text) {
+            item.remove();
+            break;
+        }
+    }
+    if (list.getElementsByTagName('li').length === 0) {
+        showEmptyMessage(list);
+    }
+}
+
 // Add to Submitted Text History (Clipboard Manager)
 function addToSubmittedTextHistory(text) {
     const existingItems = historyList.getElementsByTagName('li');
@@ -252,7 +268,6 @@ clearHistoryBtn.addEventListener('click', async () => {
 // Clear Copied Text History (Text Viewer)
 clearCopiedTextBtn.addEventListener('click', async () => {
     copiedTextList.innerHTML = '';
-    lastCopiedTextHash = ''; // Reset hash to force UI update on next poll
     try {
         const response = await fetch(`/api/clear_copied_text/${username}`, {
             method: 'POST',
@@ -287,11 +302,15 @@ submitBtn.addEventListener('click', async () => {
     try {
         // Send text to clipboard_manager.py to copy to system clipboard
         if (mode === 'copy-to-clipboard' || mode === 'both') {
+            // Trace id and timestamp let the server measure how long the text takes to reach each device
+            const traceId = window.crypto && crypto.randomUUID
+                ? crypto.randomUUID().replace(/-/g, '')
+                : Math.random().toString(16).slice(2) + Date.now().toString(16);
             const clipboardResponse = await fetch(`/api/submit_to_clipboard/${username}`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 credentials: 'include',
-                body: JSON.stringify({ text }),
+                body: JSON.stringify({ text, trace_id: traceId, client_ts: Date.now() / 1000 }),
             });
             if (!clipboardResponse.ok) {
                 const errorData = await clipboardResponse.json();
@@ -331,7 +350,58 @@ submitBtn.addEventListener('click', async () => {
     }
 });
 
+// Live Updates (Server-Sent Events): patch only the list items that changed
+function reloadHistories() {
+    lastEventTime = Date.now();
+    loadSubmittedTextHistory();
+    loadCopiedText();
+}
+
+function connectEventStream() {
+    eventSource = new EventSource(`/api/stream/${username}`, { withCredentials: true });
+    const listFor = table => (table === 'submitted_text_history' ? historyList : copiedTextList);
+
+    eventSource.addEventListener('open', () => {
+        // Changes may have been missed while disconnected, so reload after a reconnect
+        if (eventStreamOpened) {
+            reloadHistories();
+        }
+        eventStreamOpened = true;
+    });
+    ['insert', 'delete', 'clear'].forEach(type => eventSource.addEventListener(type, () => {
+        lastEventTime = Date.now();
+    }));
+    eventSource.addEventListener('insert', event => {
+        const { table, text } = JSON.parse(event.data);
+        if (table === 'submitted_text_history') {
+            addToSubmittedTextHistory(text);
+        } else {
+            addToCopiedText(text);
+        }
+    });
+    eventSource.addEventListener('delete', event => {
+        const { table, text } = JSON.parse(event.data);
+        removeFromList(listFor(table), text);
+    });
+    eventSource.addEventListener('clear', event => {
+        const list = listFor(JSON.parse(event.data).table);
+        list.innerHTML = '';
+        showEmptyMessage(list);
+    });
+    eventSource.addEventListener('reset', reloadHistories);
+}
+
+// Writes served by other instances arrive as reset events from the stream's data version check;
+// this slow reload (cheap when nothing changed, thanks to ETags) catches any the check misses
+setInterval(() => {
+    if (Date.now() - lastEventTime >= FALLBACK_RELOAD_MS) {
+        reloadHistories();
+    }
+}, 5000);
+
 // Initial Load
 document.addEventListener('DOMContentLoaded', () => {
     showClipboardManager();
+    loadCopiedText();
+    connectEventStream();
 });
\ No newline at end of file
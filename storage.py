@@ -0,0 +1,341 @@
+import itertools
+import threading
+import time
+import zlib
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+
+# Storage backends for the clipboard server:
+# - Postgres (Neon) for hosted deployments
+# - SQLite in WAL mode for single-node installs and local test runs
+
+# Tuned for a small write-light workload: WAL lets readers run alongside the single writer, and
+# synchronous=NORMAL is durable in WAL mode except for the last transactions on power loss
+SQLITE_PRAGMAS = [
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", "5000"),
+    ("cache_size", "-16000"),  # 16 MB page cache per connection
+    ("temp_store", "MEMORY"),
+    ("mmap_size", "268435456"),  # Memory-map up to 256 MB of the database file
+]
+
+def normalize_database_url(url):
+    """Point Postgres URLs at the psycopg 3 driver; other URLs are used as given."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        url = "postgresql+psycopg://" + url[len("postgresql://"):]
+    return url
+
+def is_sqlite(engine):
+    return engine.dialect.name == "sqlite"
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+# Postgres connection pool settings per deployment mode. A long-running server keeps a pool sized
+# for concurrent requests. Serverless instances (Vercel functions) handle one request at a time
+# and are frozen between invocations, so they hold few connections and recycle them sooner, before
+# Neon or its pooler drops them while the instance sleeps. Every pool pings a connection before
+# reusing it, so one that died during a freeze is replaced instead of failing the request.
+POOL_SETTINGS = {
+    "server": {"pool_size": 5, "max_overflow": 10, "pool_recycle": 1800, "pool_timeout": 30},
+    "serverless": {"pool_size": 1, "max_overflow": 2, "pool_recycle": 240, "pool_timeout": 10},
+}
+
+# libpq settings: fail fast on unreachable hosts and let TCP keepalives notice dropped connections
+POSTGRES_CONNECT_ARGS = {"connect_timeout": 10, "keepalives": 1, "keepalives_idle": 30,
+                         "keepalives_interval": 10, "keepalives_count": 3}
+
+def is_neon_pooler(url):
+    """Neon's PgBouncer endpoints have "-pooler" in the first part of the hostname."""
+    host = make_url(url).host or ""
+    return host.endswith(".neon.tech") and "-pooler" in host.split(".")[0]
+
+def create_storage_engine(url, mode="server", prepare_threshold=1, **pool_overrides):
+    """Create the SQLAlchemy engine for a Postgres or SQLite database URL.
+
+    mode picks the Postgres pool settings from POOL_SETTINGS, which pool_overrides can adjust.
+    prepare_threshold is how many times psycopg runs a query before preparing it on the server
+    (None disables prepared statements, for poolers that can't keep them).
+    """
+    url = normalize_database_url(url)
+    if not url.startswith("sqlite"):
+        if mode not in POOL_SETTINGS:
+            raise ValueError(f"Unknown database pool mode '{mode}'")
+        if mode == "serverless" and (make_url(url).host or "").endswith(".neon.tech") and not is_neon_pooler(url):
+            print("Warning: serverless instances connect straight to Neon; use the -pooler host so frozen "
+                  "instances don't hold Postgres connections")
+        options = dict(POOL_SETTINGS[mode], **pool_overrides)
+        connect_args = dict(POSTGRES_CONNECT_ARGS, prepare_threshold=prepare_threshold)
+        engine = create_engine(url, poolclass=QueuePool, pool_pre_ping=True, pool_use_lifo=True,
+                               connect_args=connect_args, **options)
+        watch_pool(engine)
+        return engine
+
+    options = {"connect_args": {"check_same_thread": False, "timeout": 30}}
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        options["poolclass"] = StaticPool  # An in-memory database only exists on its one connection
+    engine = create_engine(url, **options)
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+    watch_pool(engine)
+    return engine
+
+# Pool event counters per engine, reported by pool_stats
+pool_counters = {}
+
+def watch_pool(engine):
+    """Count new connections, checkouts and connections dropped as dead or invalid."""
+    counters = pool_counters[engine] = {"connects": 0, "checkouts": 0, "invalidated": 0}
+
+    @event.listens_for(engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        counters["connects"] += 1
+
+    @event.listens_for(engine, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters["checkouts"] += 1
+
+    @event.listens_for(engine, "invalidate")
+    def count_invalidate(dbapi_connection, connection_record, exception):
+        counters["invalidated"] += 1
+
+def pool_stats(engine):
+    """Return the pool's current state and event counters, for tuning pool sizes."""
+    pool = engine.pool
+    stats = {"url": str(engine.url), "pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow())
+    stats.update(pool_counters.get(engine, {}))
+    return stats
+
+def create_session_factory(engine):
+    """Create the session factory for an engine, queueing SQLite writers behind a single lock."""
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    if is_sqlite(engine):
+        serialize_writes(session_factory)
+    return session_factory
+
+def serialize_writes(session_factory):
+    """Let only one session at a time hold a write transaction.
+
+    SQLite allows a single writer; without this, concurrent writers in the same process spin on
+    busy_timeout and can fail with "database is locked". A session takes the lock on its first
+    INSERT, UPDATE or DELETE and releases it when its transaction commits or rolls back, so
+    waiting writers are served in turn.
+    """
+    write_lock = threading.RLock()
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def acquire_write_lock(orm_execute_state):
+        session = orm_execute_state.session
+        is_write = orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete
+        if is_write and not session.info.get("holds_write_lock"):
+            write_lock.acquire()
+            session.info["holds_write_lock"] = True
+
+    @event.listens_for(session_factory, "after_transaction_end")
+    def release_write_lock(session, transaction):
+        if transaction.parent is None and session.info.pop("holds_write_lock", False):
+            write_lock.release()
+
+# Seconds a Postgres replica is behind its primary: zero once it has replayed everything it received
+POSTGRES_REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END")
+
+def replica_lag(engine):
+    """Return how many seconds a replica is behind (0 for SQLite copies and caught-up replicas)."""
+    with engine.connect() as conn:
+        if is_sqlite(engine):
+            conn.execute(text("SELECT 1"))
+            return 0.0
+        return float(conn.execute(POSTGRES_REPLICA_LAG_QUERY).scalar() or 0)
+
+class ReplicaSet:
+    """Read-only replicas of one shard, used in turn while they are healthy.
+
+    A background thread started by start() checks each replica every check_interval seconds, so
+    requests never wait on a check. A replica that is more than max_lag seconds behind is skipped
+    until a later check finds it caught up; one that is unreachable, or whose reads fail, is
+    checked again after a backoff that doubles with each failure up to max_backoff seconds.
+    Replicas are skipped until their first check.
+    """
+
+    def __init__(self, urls, max_lag=1.0, check_interval=5.0, max_backoff=60.0, engine_options=None):
+        self.engines = [create_storage_engine(url, **(engine_options or {})) for url in urls]
+        self.session_factories = [sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                                  for engine in self.engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.max_backoff = max_backoff
+        self.healthy = [False] * len(self.engines)
+        self.failures = [0] * len(self.engines)
+        self.next_check_at = [0.0] * len(self.engines)
+        self.turn = itertools.count()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="replica-checks", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopping.is_set():
+            for index in range(len(self.engines)):
+                if self.next_check_at[index] <= time.monotonic():
+                    self.check(index)
+            self.stopping.wait(max(min(self.next_check_at) - time.monotonic(), 0.1))
+
+    def check(self, index):
+        try:
+            lag = replica_lag(self.engines[index])
+        except Exception as e:
+            self.mark_failed(index)
+            print(f"Replica {self.engines[index].url} is unavailable: {e}")
+            return False
+        self.healthy[index] = lag <= self.max_lag
+        self.failures[index] = 0
+        self.next_check_at[index] = time.monotonic() + self.check_interval
+        if not self.healthy[index]:
+            print(f"Replica {self.engines[index].url} is {lag:.1f}s behind, reading from the primary")
+        return self.healthy[index]
+
+    def mark_failed(self, index):
+        self.healthy[index] = False
+        self.failures[index] += 1
+        backoff = min(self.check_interval * 2 ** (self.failures[index] - 1), self.max_backoff)
+        self.next_check_at[index] = time.monotonic() + backoff
+
+    def session(self):
+        """Return a session on the next healthy replica, or None when none is usable."""
+        start = next(self.turn)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            if self.healthy[index]:
+                session = self.session_factories[index]()
+                session.info["replica"] = (self, index)
+                return session
+        return None
+
+class ShardRouter:
+    """Route each username to one of several databases.
+
+    Users are placed by a stable hash of their username (CRC32 modulo the number of shards), so the
+    shard list must keep its order once data is written. Users moved by the rebalancing tool are
+    pinned by overrides from the shard directory, reloaded every directory_ttl seconds so other
+    processes pick up moves.
+
+    Shards may have read replicas (replica_urls holds a list of URLs per shard). Reads through
+    read_session_on use the primary instead while the key they read for is pinned, for pin_seconds
+    after pin_primary(key). Pins only exist in this process, so reads that must see writes made by
+    other processes have to check what the replica has caught up to themselves. Replicas are only
+    used once start_replica_checks() has started their health checks.
+
+    engine_options are passed to create_storage_engine for every primary and replica.
+    """
+
+    def __init__(self, urls, load_overrides=None, directory_ttl=30, replica_urls=None, pin_seconds=5.0,
+                 max_replica_lag=1.0, replica_check_interval=5.0, engine_options=None):
+        self.engines = [create_storage_engine(url, **(engine_options or {})) for url in urls]
+        self.session_factories = [create_session_factory(engine) for engine in self.engines]
+        self.load_overrides = load_overrides
+        self.directory_ttl = directory_ttl
+        self.overrides = {}  # username -> shard index
+        self.overrides_loaded_at = None
+        replica_urls = replica_urls or []
+        if len(replica_urls) > len(urls):
+            raise ValueError(f"Replicas given for {len(replica_urls)} shards but only {len(urls)} shards exist")
+        self.replicas = [ReplicaSet(shard_urls, max_replica_lag, replica_check_interval, engine_options=engine_options)
+                         if shard_urls else None
+                         for shard_urls in replica_urls + [[]] * (len(urls) - len(replica_urls))]
+        self.pin_seconds = pin_seconds
+        self.primary_pins = {}  # key -> time.monotonic() until which reads for it go to the primary
+
+    @property
+    def shard_count(self):
+        return len(self.engines)
+
+    def hash_shard(self, username):
+        return zlib.crc32(username.encode("utf-8")) % self.shard_count
+
+    def shard_for(self, username):
+        if self.shard_count == 1:
+            return 0
+        self.refresh_overrides()
+        return self.overrides.get(username, self.hash_shard(username))
+
+    def refresh_overrides(self, force=False):
+        now = time.monotonic()
+        stale = self.overrides_loaded_at is None or now - self.overrides_loaded_at > self.directory_ttl
+        if self.load_overrides and (force or stale):
+            self.overrides_loaded_at = now
+            self.overrides = self.load_overrides()
+
+    def session_for(self, username):
+        return self.session_factories[self.shard_for(username)]()
+
+    def session_on(self, shard):
+        return self.session_factories[shard]()
+
+    def pool_stats(self):
+        """Return pool_stats for every primary and replica engine."""
+        stats = []
+        for shard, engine in enumerate(self.engines):
+            stats.append(dict(pool_stats(engine), shard=shard, role="primary"))
+            for replica_engine in self.replicas[shard].engines if self.replicas[shard] else []:
+                stats.append(dict(pool_stats(replica_engine), shard=shard, role="replica"))
+        return stats
+
+    def start_replica_checks(self):
+        for replicas in filter(None, self.replicas):
+            replicas.start()
+
+    def stop_replica_checks(self):
+        for replicas in filter(None, self.replicas):
+            replicas.stop()
+
+    def pin_primary(self, key):
+        """Send reads for key to the primary for the next pin_seconds."""
+        now = time.monotonic()
+        if len(self.primary_pins) > 10000:
+            self.primary_pins = {pinned: until for pinned, until in self.primary_pins.items() if until > now}
+        self.primary_pins[key] = now + self.pin_seconds
+
+    def is_pinned(self, key):
+        return self.primary_pins.get(key, 0) > time.monotonic()
+
+    def replica_session_on(self, shard):
+        """Return a session on a healthy replica of a shard, or None when it has none."""
+        replicas = self.replicas[shard]
+        return replicas.session() if replicas else None
+
+    def read_session_on(self, shard, pin_key=None):
+        """Return a session for reads on a shard: a replica when one is healthy and pin_key isn't pinned."""
+        if not (pin_key is not None and self.is_pinned(pin_key)):
+            session = self.replica_session_on(shard)
+            if session is not None:
+                return session
+        return self.session_on(shard)
+
+    def replica_failed(self, session):
+        """Take the replica a failed read session used out of rotation; False if it was a primary session."""
+        if "replica" not in session.info:
+            return False
+        replicas, index = session.info["replica"]
+        replicas.mark_failed(index)
+        return True
@@ -0,0 +1,74 @@
+import importlib
+import os
+import sys
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# DATABASE_URL given to the test run (e.g. a scratch Postgres database); the API tests also run against it
+EXTERNAL_DATABASE_URL = os.getenv("DATABASE_URL")
+
+SERVER_SETTINGS = ("DATABASE_URL", "DATABASE_URLS", "DATABASE_REPLICA_URLS", "WRITE_BEHIND", "DATABASE_POOL_MODE")
+
+def load_server(monkeypatch, **settings):
+    """Import a fresh server module configured by the given environment settings."""
+    for name in SERVER_SETTINGS:
+        monkeypatch.delenv(name, raising=False)
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    sys.modules.pop("server", None)
+    return importlib.import_module("server")
+
+def close_server(server):
+    for engine in server.shard_router.engines:
+        engine.dispose()
+    for replicas in filter(None, server.shard_router.replicas):
+        for engine in replicas.engines:
+            engine.dispose()
+    sys.modules.pop("server", None)
+
+@pytest.fixture
+def start_server(monkeypatch):
+    """Start the app with the given settings and return (server module, TestClient)."""
+    started = []
+
+    def start(**settings):
+        server = load_server(monkeypatch, **settings)
+        client = TestClient(server.app)
+        client.__enter__()
+        started.append((server, client))
+        return server, client
+
+    yield start
+    for server, client in reversed(started):
+        client.__exit__(None, None, None)
+        close_server(server)
+
+BACKENDS = ["sqlite-file", "sqlite-memory"] + (["external"] if EXTERNAL_DATABASE_URL else [])
+
+@pytest.fixture(params=BACKENDS)
+def database_url(request, tmp_path):
+    if request.param == "sqlite-file":
+        return f"sqlite:///{tmp_path}/clipboard.db"
+    if request.param == "sqlite-memory":
+        return "sqlite://"
+    return EXTERNAL_DATABASE_URL
+
+@pytest.fixture
+def app(start_server, database_url):
+    """The server module and a client, on each test backend."""
+    return start_server(DATABASE_URL=database_url)
+
+@pytest.fixture
+def new_user(app):
+    """Create a user with a unique name (so tests can share an external database) and return its name."""
+    server, client = app
+    username = f"test_{uuid.uuid4().hex[:12]}"
+    admin = TestClient(server.app)  # Separate cookies; the app is already started by the app fixture
+    admin.post("/admin/login", data={"username": "admin1", "password": "adminpass1"})
+    response = admin.post("/admin/bulk_add_users", json=[{"username": username, "password": "secret"}])
+    assert response.json()["report"][0]["status"] == "created"
+    return username
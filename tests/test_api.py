@@ -0,0 +1,130 @@
+"""API behavior checked against every storage backend (SQLite file, in-memory SQLite and DATABASE_URL).
+
+Run with `python -m pytest`. Point DATABASE_URL at a scratch Postgres database to include it; tests
+create users with unique names and leave their rows behind.
+"""
+
+def login(client, username, password="secret"):
+    client.post("/user/login", data={"username": username, "password": password})
+
+def test_authenticate(app, new_user):
+    _, client = app
+    response = client.post("/api/authenticate", data={"username": new_user, "password": "secret"})
+    assert response.json() == {"status": "success", "username": new_user, "role": "user"}
+    response = client.post("/api/authenticate", data={"username": new_user, "password": "wrong"})
+    assert response.status_code == 401
+
+def test_copied_text_history_is_newest_first_and_trimmed(app, new_user):
+    _, client = app
+    for index in range(12):
+        assert client.post(f"/api/submit_copied_text/{new_user}", json={"text": f"text {index}"}).json()["status"] == "success"
+    history = client.get(f"/api/copied_text_history/{new_user}").json()["copied_text_history"]
+    assert history == [f"text {index}" for index in range(11, 1, -1)]
+
+def test_copied_text_history_cursor(app, new_user):
+    _, client = app
+    client.post(f"/api/submit_copied_text/{new_user}", json={"text": "first"})
+    cursor = client.get(f"/api/copied_text_history/{new_user}").json()["cursor"]
+    client.post(f"/api/submit_copied_text/{new_user}", json={"text": "second"})
+    changes = client.get(f"/api/copied_text_history/{new_user}", params={"after_id": cursor}).json()
+    assert [item["text"] for item in changes["items"]] == ["second"]
+    assert len(changes["ids"]) == 2 and changes["cursor"] > cursor
+
+def test_unchanged_history_returns_304_until_a_write(app, new_user):
+    _, client = app
+    client.post(f"/api/submit_copied_text/{new_user}", json={"text": "one"})
+    response = client.get(f"/api/copied_text_history/{new_user}")
+    etag = response.headers["etag"]
+    assert client.get(f"/api/copied_text_history/{new_user}", headers={"If-None-Match": etag}).status_code == 304
+    client.post(f"/api/submit_copied_text/{new_user}", json={"text": "two"})
+    response = client.get(f"/api/copied_text_history/{new_user}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["copied_text_history"] == ["two", "one"]
+
+def test_write_from_another_process_invalidates_cache(app, new_user):
+    server, client = app
+    client.get(f"/api/copied_text_history/{new_user}")
+    # Another server process writes: only the database changes, not this process's memory
+    db = server.session_for(new_user)
+    try:
+        db.execute(server.copied_text_history.insert().values(username=new_user, text="elsewhere"))
+        server.bump_counter(db, new_user, "data_version")
+        db.commit()
+    finally:
+        db.close()
+    assert client.get(f"/api/copied_text_history/{new_user}").json()["copied_text_history"] == ["elsewhere"]
+
+def test_clipboard_versions_and_device_acks(app, new_user):
+    _, client = app
+    login(client, new_user)
+    versions = [client.post(f"/api/submit_to_clipboard/{new_user}", json={"text": text, "device_id": "phone"}).json()["version"]
+                for text in ("a", "b")]
+    assert versions == [1, 2]
+    latest = client.get(f"/api/get_latest_clipboard/{new_user}", params={"device_id": "laptop"}).json()
+    assert (latest["text"], latest["version"]) == ("b", 2)
+    # The device that sent the update doesn't get it back
+    assert client.get(f"/api/get_latest_clipboard/{new_user}", params={"device_id": "phone"}).json()["text"] == ""
+    client.post(f"/api/ack_clipboard/{new_user}", json={"device_id": "laptop", "version": 2})
+    client.post(f"/api/ack_clipboard/{new_user}", json={"device_id": "laptop", "version": 1})  # Late, older ack
+    assert client.get(f"/api/get_latest_clipboard/{new_user}", params={"device_id": "laptop"}).json()["text"] == ""
+
+def test_submitted_text_history_requires_login(app, new_user):
+    _, client = app
+    assert client.get(f"/api/submitted_text_history/{new_user}").status_code == 403
+    login(client, new_user)
+    client.post(f"/api/submit_submitted_text/{new_user}", json={"text": "keep"})
+    client.post(f"/api/submit_submitted_text/{new_user}", json={"text": "drop"})
+    client.post(f"/api/delete_submitted_text/{new_user}", json={"text": "drop"})
+    assert client.get(f"/api/submitted_text_history/{new_user}").json()["submitted_text_history"] == ["keep"]
+    client.post(f"/api/clear_submitted_text/{new_user}")
+    assert client.get(f"/api/submitted_text_history/{new_user}").json()["submitted_text_history"] == []
+
+def test_bulk_user_operations(app, new_user):
+    _, client = app
+    client.post("/admin/login", data={"username": "admin1", "password": "adminpass1"})
+    other = new_user + "_b"
+    report = client.post("/admin/bulk_add_users", json={"users": [
+        {"username": other, "password": "p"}, {"username": new_user, "password": "p"}, {"username": "", "password": "p"},
+    ]}).json()["report"]
+    assert [row["status"] for row in report] == ["created", "error", "error"]
+    response = client.post("/admin/bulk_update_role", json={"usernames": [other], "role": "admin"})
+    assert response.json()["status"] == "success"
+    assert client.post("/admin/bulk_update_role", json={"usernames": [other], "role": "owner"}).status_code == 400
+    report = client.post("/admin/bulk_delete_users", json={"usernames": [other, new_user + "_missing"]}).json()["report"]
+    assert [row["status"] for row in report] == ["deleted", "error"]
+
+def test_latency_percentiles_are_nearest_rank(app):
+    server, _ = app
+    summary = server.latency_percentiles([index / 1000 for index in range(1, 11)])
+    assert (summary["p50"], summary["p90"], summary["p99"]) == (5.0, 9.0, 10.0)
+
+def test_response_cache_counts_entry_overhead(app):
+    server, _ = app
+    cache = server.ResponseCache(10000)
+    for index in range(100):
+        cache.put("user", f"get_latest_clipboard:{index}", 1, b'{"text": ""}')
+    assert cache.size <= 10000 and len(cache.entries) <= 10000 // cache.ENTRY_OVERHEAD
+
+def test_cursor_reads_share_one_cache_entry(app, new_user):
+    server, client = app
+    for index in range(3):
+        client.post(f"/api/submit_copied_text/{new_user}", json={"text": f"text {index}"})
+        cursor = client.get(f"/api/copied_text_history/{new_user}").json()["cursor"]
+        client.get(f"/api/copied_text_history/{new_user}", params={"after_id": cursor})
+    assert [endpoint for username, endpoint in server.response_cache.entries if username == new_user] == [
+        "copied_text_history"]
+
+def test_malformed_bulk_requests_are_rejected(app, new_user):
+    _, client = app
+    client.post("/admin/login", data={"username": "admin1", "password": "adminpass1"})
+    assert client.post("/admin/bulk_add_users", json=["alice"]).status_code == 400
+    assert client.post("/admin/bulk_add_users", content=b"{", headers={"content-type": "application/json"}).status_code == 400
+    assert client.post("/admin/bulk_update_role", json=[new_user]).status_code == 400
+    assert client.post("/admin/bulk_update_role", json={"usernames": [new_user], "role": 1}).status_code == 400
+    assert client.post("/admin/bulk_delete_users", json={"usernames": "alice"}).status_code == 400
+    # A form without a file shows the dashboard with the error
+    response = client.post("/admin/bulk_add_users", data={"other": "field"})
+    assert response.headers["content-type"].startswith("text/html") and "No file uploaded" in response.text
+    # A bare list of usernames works for deletes, as it does for adds
+    report = client.post("/admin/bulk_delete_users", json=[new_user]).json()["report"]
+    assert [row["status"] for row in report] == ["deleted"]
@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+
+from clipboard_client import AccountSync, MemoryClipboard
+from clipboard_sync import ClipboardSync
+
+def test_local_changes_are_detected_once():
+    sync = ClipboardSync("device")
+    sync.mark_seen("start")
+    assert not sync.local_change("start")
+    assert not sync.local_change("   ")
+    assert sync.local_change("copied") and not sync.local_change("copied")
+
+def test_polled_updates_are_applied_once_in_version_order():
+    sync = ClipboardSync("device")
+    assert sync.polled('"a"', {"status": "success", "text": "", "version": 3}, 0) is None
+    assert sync.polled('"b"', {"status": "success", "text": "new", "version": 3}, 0) == (3, "new")
+    assert sync.applied(3, 0.0, 0.5) == {"device_id": "device", "version": 3, "received_ts": 0.0, "applied_ts": 0.5}
+    assert sync.polled('"c"', {"status": "success", "text": "old", "version": 2}, 0) is None
+    assert sync.poll_headers() == {"If-None-Match": '"c"'} and sync.latency["apply"].total == 1
+
+def test_relay_applies_acks_and_does_not_echo_updates(app):
+    server, _ = app
+
+    async def scenario():
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://testserver")
+        devices = [AccountSync(http, "user1", MemoryClipboard(), device_id=device_id) for device_id in ("a", "b")]
+        for device in devices:
+            device.sync.mark_seen(await device.clipboard.paste())
+        await http.post("/user/login", data={"username": "user1", "password": "userpass1"})
+        await http.post("/api/submit_to_clipboard/user1", json={"text": "from the dashboard"})
+        for device in devices:
+            await device.poll_once()
+            await device.poll_once()  # Acked: the update isn't applied again
+            await device.check_clipboard()  # The applied update isn't sent back as a copy
+        history = (await http.get("/api/copied_text_history/user1")).json()["copied_text_history"]
+        devices[0].clipboard.text = "copied on a"
+        await devices[0].check_clipboard()
+        history_after_copy = (await http.get("/api/copied_text_history/user1")).json()["copied_text_history"]
+        await http.aclose()
+        return devices, history, history_after_copy
+
+    devices, history, history_after_copy = asyncio.run(scenario())
+    assert [device.clipboard.text for device in devices] == ["copied on a", "from the dashboard"]
+    assert [device.sync.last_clipboard_version for device in devices] == [1, 1]
+    assert [device.sync.latency["apply"].total for device in devices] == [1, 1]
+    assert history == [] and history_after_copy == ["copied on a"]
+    db = server.session_for("user1")
+    try:
+        acked = {row.device_id: row.acked_version for row in db.execute(server.clipboard_devices.select())}
+    finally:
+        db.close()
+    assert acked == {"a": 1, "b": 1}
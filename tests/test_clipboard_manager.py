@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+import requests
+
+import clipboard_manager
+from clipboard_manager import ClipboardManager, LocalHistoryStore
+
+class ServerResponse:
+    """A test client response that raises like requests does (not on 304)."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def raise_for_status(self):
+        if self.response.status_code >= 400:
+            raise requests.HTTPError(f"{self.response.status_code} error")
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    """Point ClipboardManager at a test server and return (manager, server, client, copied texts)."""
+    def start(start_server, **settings):
+        server, client = start_server(**settings)
+        monkeypatch.setattr(clipboard_manager, "API_BASE_URL", "http://testserver")
+        monkeypatch.setattr(clipboard_manager, "LOCAL_CACHE_DIR", str(tmp_path / "cache"))
+        monkeypatch.setattr(requests, "get", lambda url, **kwargs: ServerResponse(client.get(url, **kwargs)))
+        monkeypatch.setattr(requests, "post", lambda url, **kwargs: ServerResponse(client.post(url, **kwargs)))
+        copied = []
+        monkeypatch.setattr(clipboard_manager.pyperclip, "copy", copied.append)
+        app = ClipboardManager()
+        app.username = "user1"
+        assert app.load_clipboard_data()
+        return app, server, client, copied
+    return start
+
+def submit(client, text):
+    client.post("/api/submit_copied_text/user1", json={"text": text})
+
+def local_texts(app):
+    return [row[0] for row in app.history_store.db.execute("SELECT text FROM items ORDER BY id DESC")]
+
+def test_local_history_store_applies_changes(tmp_path):
+    store = LocalHistoryStore(str(tmp_path / "history.db"))
+    assert (store.cursor(), store.most_recent()) == (None, None)
+    store.apply_changes([{"id": 1, "text": "one"}, {"id": 2, "text": "two"}], [1, 2], 2)
+    store.apply_changes([{"id": 3, "text": "three"}], [2, 3], 3)
+    assert (store.cursor(), store.most_recent()) == (3, "three")
+    assert store.missing_ids([2, 3, 4]) == {4}
+    store.close()
+    # The history and cursor survive a restart
+    store = LocalHistoryStore(str(tmp_path / "history.db"))
+    assert (store.cursor(), store.most_recent()) == (3, "three")
+    store.close()
+
+def test_sync_fetches_new_items_and_drops_deleted_ones(manager, start_server, tmp_path):
+    app, _, client, copied = manager(start_server, DATABASE_URL=f"sqlite:///{tmp_path}/clipboard.db")
+    submit(client, "first")
+    app.sync_history()
+    assert copied == ["first"]  # The first sync restores the most recent item
+    for index in range(10):
+        submit(client, f"text {index}")  # Trims "first" from the server
+    app.sync_history()
+    assert local_texts(app) == [f"text {index}" for index in range(9, -1, -1)]
+    app.sync_history()  # Unchanged: a 304
+    assert app.history_store.most_recent() == "text 9" and copied == ["first"]
+
+def test_sync_resyncs_after_the_user_moves_shards(manager, start_server, tmp_path):
+    urls = ",".join(f"sqlite:///{tmp_path}/shard{index}.db" for index in range(2))
+    app, server, client, _ = manager(start_server, DATABASE_URLS=urls)
+    shard = server.shard_router.shard_for("user1")
+    for index in range(3):
+        submit(client, f"text {index}")
+    app.sync_history()
+    # Rows written to the target shard first give the user's moved rows higher ids than some local ones
+    other = next(f"other{index}" for index in range(100) if server.shard_router.hash_shard(f"other{index}") != shard)
+    client.post(f"/api/submit_copied_text/{other}", json={"text": "other"})
+    server.move_user("user1", 1 - shard)
+    app.sync_history()
+    assert local_texts(app) == ["text 2", "text 1", "text 0"]
+
+def test_sync_errors_do_not_end_the_sync(manager, start_server, monkeypatch, tmp_path):
+    app, _, client, _ = manager(start_server, DATABASE_URL=f"sqlite:///{tmp_path}/clipboard.db")
+    submit(client, "first")
+
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(app.history_store, "apply_changes", fail)
+    app.sync_history()  # Logged, not raised
+    assert app.history_store.most_recent() is None
+
+def test_runs_without_a_cache_it_cannot_open(manager, start_server, tmp_path):
+    (tmp_path / "cache").write_text("not a directory")
+    app, _, client, _ = manager(start_server, DATABASE_URL=f"sqlite:///{tmp_path}/clipboard.db")
+    submit(client, "first")
+    app.sync_history()
+    assert app.history_store.most_recent() == "first"
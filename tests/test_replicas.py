@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from storage import ReplicaSet
+
+def wait_until_checked(replicas):
+    deadline = time.monotonic() + 5
+    while not all(replicas.healthy) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert all(replicas.healthy)
+
+@pytest.fixture
+def replicated(start_server, tmp_path):
+    server, client = start_server(DATABASE_URL=f"sqlite:///{tmp_path}/primary.db",
+                                  DATABASE_REPLICA_URLS=f"sqlite:///{tmp_path}/replica.db")
+    replicas = server.shard_router.replicas[0]
+    wait_until_checked(replicas)
+    return server, client, replicas
+
+def test_reads_use_the_replica_only_once_it_has_caught_up(replicated):
+    server, client, replicas = replicated
+    server.metadata.create_all(replicas.engines[0])  # An empty copy that doesn't receive the writes
+    client.post("/api/submit_copied_text/reader", json={"text": "fresh"})
+    # Another process serves the next read: it has no pin for the user, and the replica is behind
+    server.shard_router.primary_pins.clear()
+    for _ in range(2):
+        assert client.get("/api/copied_text_history/reader").json()["copied_text_history"] == ["fresh"]
+
+    # The replica catches up (with a text of its own, to show where the read went)
+    with replicas.engines[0].begin() as conn:
+        conn.execute(server.copied_text_history.insert().values(username="reader", text="replicated"))
+        conn.execute(server.user_counters.insert().values(username="reader", data_version=1))
+    server.response_cache.entries.clear()
+    assert client.get("/api/copied_text_history/reader").json()["copied_text_history"] == ["replicated"]
+
+def test_cache_keeps_the_newer_version(app):
+    server, _ = app
+    newer = server.response_cache.put("cached", "endpoint", 2, b"[2]")
+    server.response_cache.put("cached", "endpoint", 1, b"[1]")
+    assert server.response_cache.get("cached", "endpoint", 2) == newer
+
+def test_failed_replica_read_falls_back_to_the_primary(replicated):
+    server, client, replicas = replicated
+    client.post("/api/submit_copied_text/reader", json={"text": "fresh"})
+    server.shard_router.primary_pins.clear()
+    # The replica has no tables, so the read fails there
+    assert client.get("/api/copied_text_history/reader").json()["copied_text_history"] == ["fresh"]
+    assert replicas.healthy == [False] and replicas.next_check_at[0] > time.monotonic()
+
+def test_replicas_are_skipped_until_checked_and_back_off_when_failing(tmp_path):
+    replicas = ReplicaSet([f"sqlite:///{tmp_path}/replica.db"], check_interval=1.0, max_backoff=3.0)
+    assert replicas.session() is None
+    assert replicas.check(0) and replicas.session() is not None
+    backoffs = []
+    for _ in range(4):
+        replicas.mark_failed(0)
+        backoffs.append(round(replicas.next_check_at[0] - time.monotonic()))
+    assert backoffs == [1, 2, 3, 3]
+    assert replicas.session() is None
+    replicas.engines[0].dispose()
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import event
+
+@pytest.fixture
+def sharded(start_server, tmp_path):
+    urls = ",".join(f"sqlite:///{tmp_path}/shard{index}.db" for index in range(2))
+    return start_server(DATABASE_URLS=urls)
+
+def user_on_shard(server, shard, prefix):
+    return next(f"{prefix}{index}" for index in range(100) if server.shard_router.hash_shard(f"{prefix}{index}") == shard)
+
+def test_users_are_routed_to_their_shard(sharded):
+    server, client = sharded
+    usernames = [user_on_shard(server, shard, "routed") for shard in (0, 1)]
+    for username in usernames:
+        client.post(f"/api/submit_copied_text/{username}", json={"text": f"from {username}"})
+    for shard, username in enumerate(usernames):
+        db = server.shard_router.session_on(shard)
+        try:
+            rows = db.execute(server.copied_text_history.select()).fetchall()
+        finally:
+            db.close()
+        assert [row.username for row in rows] == [username]
+
+def test_moved_user_keeps_history_and_old_cursors_resync(sharded):
+    server, client = sharded
+    username = user_on_shard(server, 0, "mover")
+    # Fill the source shard first, so the user's ids there are higher than they will be on the target
+    neighbour = user_on_shard(server, 0, "neighbour")
+    for index in range(5):
+        client.post(f"/api/submit_copied_text/{neighbour}", json={"text": f"neighbour {index}"})
+    for index in range(3):
+        client.post(f"/api/submit_copied_text/{username}", json={"text": f"text {index}"})
+    old_cursor = client.get(f"/api/copied_text_history/{username}").json()["cursor"]
+
+    assert server.move_user(username, 1)
+    assert server.shard_router.shard_for(username) == 1
+    changes = client.get(f"/api/copied_text_history/{username}", params={"after_id": old_cursor}).json()
+    assert changes["cursor"] < old_cursor
+    assert [item["text"] for item in changes["items"]] == ["text 2", "text 1", "text 0"]
+    assert {item["id"] for item in changes["items"]} == set(changes["ids"])
+
+def test_moved_user_keeps_clipboard_versions(sharded):
+    server, client = sharded
+    username = user_on_shard(server, 0, "clipper")
+    client.post("/admin/login", data={"username": "admin1", "password": "adminpass1"})
+    client.post("/admin/bulk_add_users", json=[{"username": username, "password": "secret"}])
+    client.post("/user/login", data={"username": username, "password": "secret"})
+    client.post(f"/api/submit_to_clipboard/{username}", json={"text": "before"})
+    server.move_user(username, 1)
+    assert client.post("/api/authenticate", data={"username": username, "password": "secret"}).status_code == 200
+    response = client.post(f"/api/submit_to_clipboard/{username}", json={"text": "after"})
+    assert response.json()["version"] == 2
+
+def admin_client(server, client):
+    client.post("/admin/login", data={"username": "admin1", "password": "adminpass1"})
+    return client
+
+def test_bulk_delete_clears_the_directory_in_one_commit(sharded):
+    server, client = sharded
+    admin_client(server, client)
+    usernames = [f"bulk{index}" for index in range(20)]
+    client.post("/admin/bulk_add_users", json=[{"username": username, "password": "p"} for username in usernames])
+    for username in usernames[:5]:
+        server.move_user(username, 1 - server.shard_router.hash_shard(username))
+    commits = []
+    event.listen(server.shard_router.engines[0], "commit", lambda conn: commits.append(conn))
+    response = client.post("/admin/bulk_delete_users", json={"usernames": usernames})
+    assert {row["status"] for row in response.json()["report"]} == {"deleted"}
+    assert len(commits) == 2  # The users on shard 0, then the directory
+    assert server.shard_router.overrides == {}
+
+def test_bulk_report_shows_each_shards_outcome(sharded):
+    server, client = sharded
+    admin_client(server, client)
+    usernames = [user_on_shard(server, shard, "partial") for shard in (0, 1)]
+    with server.shard_router.engines[1].begin() as conn:
+        # Inserts on shard 1 now fail, after the existing usernames were looked up
+        conn.exec_driver_sql("CREATE TRIGGER fail_inserts BEFORE INSERT ON users "
+                             "BEGIN SELECT RAISE(ABORT, 'shard unavailable'); END")
+    response = client.post("/admin/bulk_add_users", json=[{"username": username, "password": "p"}
+                                                          for username in usernames])
+    assert response.status_code == 500
+    assert [row["status"] for row in response.json()["report"]] == ["created", "error"]
+
+def test_cursor_from_an_older_epoch_gets_every_item(sharded):
+    server, client = sharded
+    username = user_on_shard(server, 0, "epoch")
+    for index in range(3):
+        client.post(f"/api/submit_copied_text/{username}", json={"text": f"text {index}"})
+    history = client.get(f"/api/copied_text_history/{username}").json()
+    # Rows already on the target make the moved ids overlap the old ones rather than all fall below them
+    client.post(f"/api/submit_copied_text/{user_on_shard(server, 1, 'target')}", json={"text": "target"})
+    server.move_user(username, 1)
+    params = {"after_id": history["items"][1]["id"], "epoch": history["epoch"]}
+    changes = client.get(f"/api/copied_text_history/{username}", params=params).json()
+    assert changes["epoch"] != history["epoch"]
+    assert [item["text"] for item in changes["items"]] == ["text 2", "text 1", "text 0"]
@@ -0,0 +1,38 @@
+import pytest
+
+from conftest import load_server
+from write_behind import WriteBehindBuffer
+
+def test_failed_group_is_retried_alone():
+    flushed = []
+    failures = {"b": 1}
+
+    def flush_batch(batch):
+        key = batch[0][0]
+        if failures.get(key):
+            failures[key] -= 1
+            raise RuntimeError("shard unavailable")
+        flushed.extend(batch)
+
+    buffer = WriteBehindBuffer(flush_batch, group_key=lambda item: item[0])
+    buffer.flush([("a", 1), ("b", 1), ("a", 2)])
+    assert sorted(flushed) == [("a", 1), ("a", 2), ("b", 1)]
+    assert (buffer.items_flushed, buffer.items_dropped) == (3, 0)
+
+def test_submissions_are_flushed_to_each_shard(start_server, tmp_path):
+    urls = ",".join(f"sqlite:///{tmp_path}/shard{index}.db" for index in range(2))
+    server, client = start_server(DATABASE_URLS=urls, WRITE_BEHIND="1")
+    usernames = [f"writer{index}" for index in range(6)]
+    assert len({server.shard_router.shard_for(username) for username in usernames}) == 2
+    for username in usernames:
+        for index in range(3):
+            client.post(f"/api/submit_copied_text/{username}", json={"text": f"{username} {index}"})
+    server.copied_text_buffer.stop()  # Flushes everything queued
+    for username in usernames:
+        history = client.get(f"/api/copied_text_history/{username}").json()["copied_text_history"]
+        assert history == [f"{username} {index}" for index in (2, 1, 0)]
+
+def test_write_behind_is_refused_on_serverless(monkeypatch, tmp_path):
+    with pytest.raises(ValueError):
+        load_server(monkeypatch, DATABASE_URL=f"sqlite:///{tmp_path}/clipboard.db", WRITE_BEHIND="1",
+                    DATABASE_POOL_MODE="serverless")
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+
+class WriteBehindBuffer:
+    """Collect writes in memory and hand them to flush_batch in groups from a background thread.
+
+    A batch is flushed once interval seconds have passed since its first item arrived, or as soon
+    as it holds max_batch items. Items are acknowledged before they reach the database, so
+    anything still queued is lost if the process dies; stop() flushes what is left on shutdown.
+
+    With group_key, a batch is split by key and each group is flushed (and retried) on its own,
+    for writes that commit separately, e.g. one transaction per database shard.
+    """
+
+    def __init__(self, flush_batch, interval=0.005, max_batch=500, group_key=None):
+        self.flush_batch = flush_batch
+        self.group_key = group_key
+        self.interval = interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stopping = False
+        self.batches_flushed = 0
+        self.items_flushed = 0
+        self.items_dropped = 0
+
+    def start(self):
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Flush everything still queued and stop the background thread."""
+        self.stopping = True
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, item):
+        self.queue.put(item)
+
+    def run(self):
+        while not (self.stopping and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        if self.group_key is None:
+            self.flush_group(batch)
+            return
+        groups = defaultdict(list)
+        for item in batch:
+            groups[self.group_key(item)].append(item)
+        for group in groups.values():
+            self.flush_group(group)
+
+    def flush_group(self, batch):
+        # Retry once, so a dropped connection doesn't lose the batch
+        for attempt in range(2):
+            try:
+                self.flush_batch(batch)
+                self.batches_flushed += 1
+                self.items_flushed += len(batch)
+                return
+            except Exception as e:
+                print(f"Error flushing write-behind batch of {len(batch)} items (attempt {attempt + 1}): {e}")
+        self.items_dropped += len(batch)